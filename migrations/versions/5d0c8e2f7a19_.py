@@ -0,0 +1,100 @@
+"""consolidate likes and dislikes into one preference table
+
+Revision ID: 5d0c8e2f7a19
+Revises: e6a1b9f3c850
+Create Date: 2026-10-18 15:48:02.517340
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d0c8e2f7a19'
+down_revision = 'e6a1b9f3c850'
+branch_labels = None
+depends_on = None
+
+# old table, its id and name columns, the collection it serves, kind, polarity
+SOURCES = (
+    ('genre_like', 'genre_id', 'genre_name', 'genres_liked', 'genre', 'like'),
+    ('genre_dislike', 'genre_id', 'genre_name', 'genres_disliked', 'genre', 'dislike'),
+    ('tag_like', 'tag_id', 'tag_name', 'tags_liked', 'tag', 'like'),
+    ('tag_dislike', 'tag_id', 'tag_name', 'tags_disliked', 'tag', 'dislike'),
+)
+
+user = sa.table('user', sa.column('id', sa.Integer), sa.column('version', sa.Integer))
+tombstone = sa.table('tombstone', sa.column('user_id', sa.Integer), sa.column('collection', sa.String),
+                     sa.column('row_id', sa.Integer), sa.column('version', sa.Integer))
+preference = sa.table('preference', sa.column('id', sa.Integer), sa.column('user_id', sa.Integer),
+                      sa.column('kind', sa.String), sa.column('polarity', sa.String), sa.column('external_id', sa.String),
+                      sa.column('name', sa.String), sa.column('version', sa.Integer))
+
+
+def source_table(name, id_field, name_field):
+    return sa.table(name, sa.column('id', sa.Integer), sa.column('user_id', sa.Integer), sa.column(id_field, sa.String),
+                    sa.column(name_field, sa.String), sa.column('version', sa.Integer))
+
+
+def create_source(name, id_field, name_field):
+    op.create_table(name,
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column(name_field, sa.String(length=50), nullable=True),
+    sa.Column(id_field, sa.String(length=50), nullable=True),
+    sa.Column('version', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_%s_user_id' % name, name, ['user_id'], unique=False)
+    op.create_index('ix_%s_user_id_version' % name, name, ['user_id', 'version'], unique=False)
+
+
+def drop_source(name):
+    op.drop_index('ix_%s_user_id_version' % name, table_name=name)
+    op.drop_index('ix_%s_user_id' % name, table_name=name)
+    op.drop_table(name)
+
+
+def upgrade():
+    op.create_table('preference',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('polarity', sa.String(length=10), nullable=False),
+    sa.Column('external_id', sa.String(length=50), nullable=True),
+    sa.Column('name', sa.String(length=50), nullable=True),
+    sa.Column('version', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_preference_profile', 'preference', ['user_id', 'kind', 'polarity', 'external_id', 'name'], unique=False, postgresql_include=['id'])
+    op.create_index('ix_preference_user_id_version', 'preference', ['user_id', 'version'], unique=False)
+
+    # The rows get new ids. Bump every owner's version and tombstone the old ids so
+    # delta-sync clients drop them and pick the rows up again under the new ones.
+    owners = sa.union(*[sa.select(source_table(*source[:3]).c.user_id) for source in SOURCES])
+    op.execute(user.update().where(user.c.id.in_(sa.select(owners.subquery().c.user_id))).values(version=user.c.version + 1))
+    for name, id_field, name_field, collection, kind, polarity in SOURCES:
+        source = source_table(name, id_field, name_field)
+        owned = sa.select(source.c.user_id, sa.literal(collection), source.c.id, user.c.version).join(user, user.c.id == source.c.user_id)
+        op.execute(tombstone.insert().from_select(['user_id', 'collection', 'row_id', 'version'], owned.order_by(source.c.id)))
+        rows = sa.select(source.c.user_id, sa.literal(kind), sa.literal(polarity), source.c[id_field], source.c[name_field], user.c.version) \
+            .join(user, user.c.id == source.c.user_id).order_by(source.c.id)
+        op.execute(preference.insert().from_select(['user_id', 'kind', 'polarity', 'external_id', 'name', 'version'], rows))
+
+    for name, _, _, _, _, _ in SOURCES:
+        drop_source(name)
+
+
+def downgrade():
+    for name, id_field, name_field, collection, kind, polarity in SOURCES:
+        create_source(name, id_field, name_field)
+        source = source_table(name, id_field, name_field)
+        rows = sa.select(preference.c.id, preference.c.user_id, preference.c.external_id, preference.c.name, preference.c.version) \
+            .where(preference.c.kind == kind, preference.c.polarity == polarity)
+        op.execute(source.insert().from_select(['id', 'user_id', id_field, name_field, 'version'], rows))
+
+    op.drop_index('ix_preference_user_id_version', table_name='preference')
+    op.drop_index('ix_preference_profile', table_name='preference')
+    op.drop_table('preference')
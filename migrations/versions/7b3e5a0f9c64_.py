@@ -0,0 +1,61 @@
+"""shared game catalog
+
+Revision ID: 7b3e5a0f9c64
+Revises: a4f17c93d2b6
+Create Date: 2026-10-18 17:22:09.431576
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3e5a0f9c64'
+down_revision = 'a4f17c93d2b6'
+branch_labels = None
+depends_on = None
+
+game = sa.table('game', sa.column('game_id', sa.String), sa.column('game_name', sa.String), sa.column('game_image', sa.String))
+backlog = sa.table('backlog', sa.column('id', sa.Integer), sa.column('user_id', sa.Integer), sa.column('game_id', sa.String),
+                   sa.column('game_name', sa.String), sa.column('game_image', sa.String), sa.column('version', sa.Integer))
+user = sa.table('user', sa.column('id', sa.Integer), sa.column('version', sa.Integer))
+
+
+def upgrade():
+    op.create_table('game',
+    sa.Column('game_id', sa.String(length=120), nullable=False),
+    sa.Column('game_name', sa.String(length=250), nullable=True),
+    sa.Column('game_image', sa.String(length=120), nullable=True),
+    sa.PrimaryKeyConstraint('game_id')
+    )
+    # One catalog entry per game_id, with the name and image of its newest backlog row.
+    # Rows without a game_id have nothing to point at and lose their name and image.
+    newest = sa.select(sa.func.max(backlog.c.id)).where(backlog.c.game_id.isnot(None)).group_by(backlog.c.game_id)
+    op.execute(game.insert().from_select(['game_id', 'game_name', 'game_image'],
+                                         sa.select(backlog.c.game_id, backlog.c.game_name, backlog.c.game_image).where(backlog.c.id.in_(newest))))
+
+    # Rows that now show another name or image than they stored are writes as far as
+    # ETags and delta sync are concerned: bump their owners' versions and stamp them.
+    # (The DISTINCT derived table lets MySQL update the table it reads.)
+    changed = sa.select(backlog.c.id).select_from(backlog.outerjoin(game, game.c.game_id == backlog.c.game_id)).where(sa.or_(
+        backlog.c.game_name.is_distinct_from(game.c.game_name), backlog.c.game_image.is_distinct_from(game.c.game_image))).distinct().subquery('changed')
+    changed = sa.select(changed.c.id)
+    op.execute(user.update().where(user.c.id.in_(sa.select(backlog.c.user_id).where(backlog.c.id.in_(changed)))).values(version=user.c.version + 1))
+    op.execute(backlog.update().where(backlog.c.id.in_(changed)).values(
+        version=sa.select(user.c.version).where(user.c.id == backlog.c.user_id).scalar_subquery()))
+
+    with op.batch_alter_table('backlog') as batch_op:
+        batch_op.create_foreign_key('fk_backlog_game_id_game', 'game', ['game_id'], ['game_id'])
+        batch_op.drop_column('game_image')
+        batch_op.drop_column('game_name')
+
+
+def downgrade():
+    with op.batch_alter_table('backlog') as batch_op:
+        batch_op.add_column(sa.Column('game_name', sa.String(length=250), nullable=True))
+        batch_op.add_column(sa.Column('game_image', sa.String(length=120), nullable=True))
+        batch_op.drop_constraint('fk_backlog_game_id_game', type_='foreignkey')
+    op.execute(backlog.update().values(
+        game_name=sa.select(game.c.game_name).where(game.c.game_id == backlog.c.game_id).scalar_subquery(),
+        game_image=sa.select(game.c.game_image).where(game.c.game_id == backlog.c.game_id).scalar_subquery()))
+    op.drop_table('game')
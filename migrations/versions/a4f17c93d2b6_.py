@@ -0,0 +1,75 @@
+"""unique preference and platform keys, dedupe existing rows
+
+Revision ID: a4f17c93d2b6
+Revises: 5d0c8e2f7a19
+Create Date: 2026-10-18 16:40:55.803112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4f17c93d2b6'
+down_revision = '5d0c8e2f7a19'
+branch_labels = None
+depends_on = None
+
+user = sa.table('user', sa.column('id', sa.Integer), sa.column('version', sa.Integer))
+tombstone = sa.table('tombstone', sa.column('user_id', sa.Integer), sa.column('collection', sa.String),
+                     sa.column('row_id', sa.Integer), sa.column('version', sa.Integer))
+preference = sa.table('preference', sa.column('id', sa.Integer), sa.column('user_id', sa.Integer),
+                      sa.column('kind', sa.String), sa.column('polarity', sa.String), sa.column('external_id', sa.String))
+platform = sa.table('platform', sa.column('id', sa.Integer), sa.column('user_id', sa.Integer), sa.column('platform_id', sa.String))
+
+# table, the columns of its new unique key, and the collection (or, for preference, the
+# collection per (kind, polarity)) its tombstones belong to
+DEDUPE = (
+    (preference, ('user_id', 'kind', 'polarity', 'external_id'), {
+        ('genre', 'like'): 'genres_liked',
+        ('genre', 'dislike'): 'genres_disliked',
+        ('tag', 'like'): 'tags_liked',
+        ('tag', 'dislike'): 'tags_disliked',
+    }),
+    (platform, ('user_id', 'platform_id'), 'user_platforms'),
+)
+
+
+def duplicate_ids(table, keys):
+    # Every row but the oldest of each key. Keys with a NULL never conflict, so those
+    # rows stay. MySQL only lets a DELETE read its own table through a derived table
+    # it materializes, hence the DISTINCT.
+    complete = sa.and_(*[table.c[name].isnot(None) for name in keys])
+    oldest = sa.select(sa.func.min(table.c.id)).where(complete).group_by(*[table.c[name] for name in keys])
+    duplicates = sa.select(table.c.id).where(complete, table.c.id.notin_(oldest)).distinct().subquery('duplicates')
+    return sa.select(duplicates.c.id)
+
+
+def upgrade():
+    # Retried POSTs left duplicate rows behind. Delete them in bulk, bumping their
+    # owners' versions and tombstoning them so delta-sync clients drop them too.
+    for table, keys, collections in DEDUPE:
+        duplicates = duplicate_ids(table, keys)
+        owners = sa.select(table.c.user_id).where(table.c.id.in_(duplicates)).distinct().subquery('owners')
+        op.execute(user.update().where(user.c.id.in_(sa.select(owners.c.user_id))).values(version=user.c.version + 1))
+        if isinstance(collections, str):
+            collections = {(): collections}
+        for match, collection in collections.items():
+            rows = sa.select(table.c.user_id, sa.literal(collection), table.c.id, user.c.version) \
+                .join(user, user.c.id == table.c.user_id).where(table.c.id.in_(duplicates))
+            if match:
+                rows = rows.where(table.c.kind == match[0], table.c.polarity == match[1])
+            op.execute(tombstone.insert().from_select(['user_id', 'collection', 'row_id', 'version'], rows.order_by(table.c.id)))
+        op.execute(table.delete().where(table.c.id.in_(duplicates)))
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_index('uq_platform_user_id_platform_id', 'platform', ['user_id', 'platform_id'], unique=True)
+    op.create_index('uq_preference_user_id_kind_polarity_external_id', 'preference', ['user_id', 'kind', 'polarity', 'external_id'], unique=True)
+    # ### end Alembic commands ###
+
+
+def downgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_index('uq_preference_user_id_kind_polarity_external_id', table_name='preference')
+    op.drop_index('uq_platform_user_id_platform_id', table_name='platform')
+    # ### end Alembic commands ###
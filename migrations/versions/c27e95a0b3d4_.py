@@ -0,0 +1,43 @@
+"""row versions and tombstones for delta sync
+
+Revision ID: c27e95a0b3d4
+Revises: 8f4a6c1d2e90
+Create Date: 2026-10-18 13:05:51.902716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c27e95a0b3d4'
+down_revision = '8f4a6c1d2e90'
+branch_labels = None
+depends_on = None
+
+TABLES = ('backlog', 'genre_dislike', 'genre_like', 'platform', 'tag_dislike', 'tag_like')
+
+
+def upgrade():
+    op.create_table('tombstone',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('collection', sa.String(length=30), nullable=False),
+    sa.Column('row_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tombstone_user_id_version', 'tombstone', ['user_id', 'version'], unique=False)
+    for table in TABLES:
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+        op.create_index('ix_%s_user_id_version' % table, table, ['user_id', 'version'], unique=False)
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.drop_index('ix_%s_user_id_version' % table, table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('version')
+    op.drop_index('ix_tombstone_user_id_version', table_name='tombstone')
+    op.drop_table('tombstone')
@@ -1,7 +1,69 @@
 import os
 from flask_admin import Admin
-from models import db, User, Platform, Backlog, GenreLike, GenreDislike, TagLike, TagDislike
+from sqlalchemy import inspect
+from models import db, User, Platform, Game, Backlog, GenreLike, GenreDislike, TagLike, TagDislike, Tombstone, PreferenceSet
 from flask_admin.contrib.sqla import ModelView
+from catalog import game_catalog
+
+# Edits of a user bump their version, so the ETag of GET /user/<id> changes
+class UserView(ModelView):
+    # Only ever moves forward: a version set back could match an ETag a client holds
+    form_excluded_columns = ('version',)
+
+    def on_model_change(self, form, model, is_created):
+        if not is_created:
+            model.version = User.version + 1
+
+# Admin writes to a collection count like the API's: the owner's version is bumped
+# and the row stamped with it (ETags, user cache, delta sync), a delete or a move to
+# another user leaves a tombstone, and liked and disliked ids stay in step with the
+# PreferenceSet.
+class CollectionView(ModelView):
+    form_excluded_columns = ('version',)
+
+    def __init__(self, model, session, collection, **kwargs):
+        self.collection = collection
+        super().__init__(model, session, **kwargs)
+
+    def on_model_change(self, form, model, is_created):
+        # The form sets the relationship; user_id still holds the owner before the edit
+        owner = model.user.id if model.user is not None else model.user_id
+        model.version = User.bump_version(owner)
+        if not is_created and model.user_id is not None and model.user_id != owner:
+            Tombstone.record(model.user_id, self.collection, model.id)
+            self.sync(model, model.user_id)
+        self.sync(model, owner)
+
+    def on_model_delete(self, model):
+        Tombstone.record(model.user_id, self.collection, model.id)
+
+    # Runs after the delete was committed: the set is re-checked against the rows left
+    def after_model_delete(self, model):
+        if self.sync(model, model.user_id):
+            db.session.commit()
+
+    def sync(self, model, user_id):
+        if self.collection not in PreferenceSet.sources:
+            return False
+        history = inspect(model).attrs.external_id.history
+        PreferenceSet.sync(user_id, self.collection, [value for value in history.sum() if value is not None])
+        return True
+
+# Catalog edits reach every backlog with the game: their owners' versions are bumped
+# with the edit, and the editing worker drops its cached copy once it is saved
+class GameView(ModelView):
+    def on_model_change(self, form, model, is_created):
+        if not is_created:
+            Game.changed([model.game_id])
+
+    def after_model_change(self, form, model, is_created):
+        game_catalog.invalidate(model.game_id)
+
+    def on_model_delete(self, model):
+        Game.changed([model.game_id])
+
+    def after_model_delete(self, model):
+        game_catalog.invalidate(model.game_id)
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
@@ -10,13 +72,14 @@ def setup_admin(app):
 
     
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Platform, db.session))
-    admin.add_view(ModelView(Backlog, db.session))
-    admin.add_view(ModelView(GenreLike, db.session))
-    admin.add_view(ModelView(GenreDislike, db.session))
-    admin.add_view(ModelView(TagLike, db.session))
-    admin.add_view(ModelView(TagDislike, db.session))
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(CollectionView(Platform, db.session, 'user_platforms'))
+    admin.add_view(GameView(Game, db.session))
+    admin.add_view(CollectionView(Backlog, db.session, 'user_games'))
+    admin.add_view(CollectionView(GenreLike, db.session, 'genres_liked'))
+    admin.add_view(CollectionView(GenreDislike, db.session, 'genres_disliked'))
+    admin.add_view(CollectionView(TagLike, db.session, 'tags_liked'))
+    admin.add_view(CollectionView(TagDislike, db.session, 'tags_disliked'))
 
     # You can duplicate that line to add mew models
     # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
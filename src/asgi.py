@@ -0,0 +1,229 @@
+"""
+ASGI server for the API: the app of wsgi.py, with the per-user endpoints served on an
+asyncio event loop instead of holding a thread each.
+
+    $ pipenv run serve-async
+    $ GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn --config src/gunicorn.conf.py --chdir src asgi:app
+
+Requests under /user/<id> (the user, their collections, profile and changes, and every
+write to them) run the Flask handlers on the event loop, with `db.session` bound to a
+session of SQLAlchemy's async engine. While one of them waits on the database the loop
+serves the others, so a process has as many requests in flight as its connection pool
+allows (DB_POOL_SIZE + DB_MAX_OVERFLOW, see database.py) instead of one per thread.
+Routes, payloads, ETags, caching and compression are the Flask app's own.
+
+/user/<id>/profile first reads the collections that aren't cached at the same time, on
+a connection each, so the handler then finds all of them in the cache.
+
+Everything else (login and register with their password hashing, recommendations,
+admin, metrics) runs on a thread pool, as under gunicorn, and is the only part that
+reads from the replicas of replicas.py.
+
+Needs `uvicorn`, SQLAlchemy's asyncio extra (`greenlet`) and an async driver: asyncpg
+for PostgreSQL, aiomysql for MySQL or aiosqlite for SQLite (all in the Pipfile). The
+engine uses DB_CONNECTION_STRING with its driver swapped for that one.
+
+The user cache is read and written on the loop too. With CACHE_BACKEND=redis (see
+cache.py) that is a synchronous redis client: while it waits on redis, the whole loop
+waits, and no other request is served. Keep redis close, or the memory backend.
+
+    ASYNC_DB_URL=           the async engine's URL, where swapping the driver isn't enough
+    ASYNC_THREADS=4         threads for the routes that aren't served on the loop
+"""
+import asyncio
+import io
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+from flask import request
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.util import await_only
+from werkzeug.datastructures import MultiDict
+from cache import user_cache, NullCache
+from database import engine_options, TimedAsyncQueuePool
+from main import app as flask_app, load_collections, requested_user_fields, user_version
+from models import db, User, Preference
+from utils import APIException
+
+ASYNC_DRIVERS = {'postgresql': 'asyncpg', 'mysql': 'aiomysql', 'sqlite': 'aiosqlite'}
+# The user and everything under it, but the ranking, which is CPU-bound
+ON_LOOP = re.compile(r'^/user/[^/]+/?$|^/user/\d+/(?!recommendations/?$)')
+PROFILE = re.compile(r'^/user/(\d+)/profile/?$')
+# WSGI environ key of the session a request served on the loop uses
+SESSION_KEY = 'hexbreak.async_session'
+
+def async_url(uri):
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError('No async driver known for %s, set ASYNC_DB_URL.' % backend)
+    return url.set(drivername='%s+%s' % (backend, ASYNC_DRIVERS[backend]))
+
+async def read_body(receive):
+    body = []
+    while True:
+        message = await receive()
+        body.append(message.get('body', b''))
+        if message['type'] != 'http.request' or not message.get('more_body'):
+            return b''.join(body)
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    root_path = scope.get('root_path', '')
+    path = scope['path'][len(root_path):] if scope['path'].startswith(root_path) else scope['path']
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+# Runs the Flask app on `environ` and hands its response to `send`, which returns once
+# the ASGI server has taken each message. A streamed body is sent as it is produced.
+def run_wsgi(environ, send):
+    head = []
+
+    def start_response(status, headers, exc_info=None):
+        head[:] = [{
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        }]
+
+    body = flask_app(environ, start_response)
+    try:
+        for chunk in body:
+            if head:
+                send(head.pop())
+            if chunk:
+                send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if head:
+            send(head.pop())
+        send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+# For requests served on the loop, registered ahead of every other before_request
+# function: the handlers' db.session is the request's session on the async engine
+def use_async_session():
+    session = request.environ.get(SESSION_KEY)
+    if session is not None:
+        db.session.registry.set(session)
+
+# fn(*args) in an app context whose db.session is `session`
+def _in_app_context(session, fn, args):
+    with flask_app.app_context():
+        db.session.registry.set(session)
+        return fn(*args)
+
+class AsyncServer:
+    def __init__(self, app):
+        self.app = app
+        self.engine = None
+        self.executor = None
+
+    # On the first request or at startup, in the worker process
+    def start(self):
+        if self.engine is not None:
+            return
+        url = os.environ.get('ASYNC_DB_URL') or async_url(self.app.config['SQLALCHEMY_DATABASE_URI'])
+        self.engine = create_async_engine(url, **engine_options(str(url), poolclass=TimedAsyncQueuePool))
+        self.executor = ThreadPoolExecutor(max_workers=int(os.environ.get('ASYNC_THREADS', 4)))
+
+    async def stop(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.executor.shutdown(wait=False)
+            self.engine = self.executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        self.start()
+        environ = wsgi_environ(scope, await read_body(receive))
+        path = environ['PATH_INFO']
+
+        if not ON_LOOP.match(path):
+            loop = asyncio.get_running_loop()
+
+            def send_from_thread(message):
+                asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+            await loop.run_in_executor(self.executor, run_wsgi, environ, send_from_thread)
+            return
+
+        profile = PROFILE.match(path)
+        # Not worth it when the client may get a 304
+        if profile is not None and scope['method'] == 'GET' and 'HTTP_IF_NONE_MATCH' not in environ:
+            await self.prefetch(int(profile.group(1)), environ['QUERY_STRING'])
+        async with AsyncSession(self.engine) as session:
+            await session.run_sync(self.serve, environ, lambda message: await_only(send(message)))
+
+    # Runs in SQLAlchemy's greenlet: each wait on the database goes back to the loop
+    def serve(self, session, environ, send):
+        environ[SESSION_KEY] = session
+        run_wsgi(environ, send)
+
+    async def run(self, fn, *args):
+        async with AsyncSession(self.engine) as session:
+            return await session.run_sync(_in_app_context, fn, args)
+
+    # Caches the profile's collections that aren't cached, read at the same time on a
+    # connection each (the preference ones together, in one scan)
+    async def prefetch(self, user_id, query_string):
+        if isinstance(user_cache.backend, NullCache):
+            return
+        try:
+            _, collections = requested_user_fields(base=('id', 'username'), args=MultiDict(parse_qsl(query_string, keep_blank_values=True)))
+        except APIException:
+            # The handler answers with the error
+            return
+        # Read first, like the handler does: the loads are cached at this version
+        version = await self.run(user_version, user_id)
+        if version is None:
+            return
+        missing = user_cache.uncached(user_id, collections, version)
+        preferences = [name for name in missing if issubclass(User.child_model(name), Preference)]
+        groups = [[name] for name in missing if name not in preferences] + ([preferences] if preferences else [])
+        for loaded in await asyncio.gather(*(self.run(load_collections, user_id, group) for group in groups), return_exceptions=True):
+            # What failed is read again by the handler
+            if isinstance(loaded, dict):
+                user_cache.store(user_id, loaded, version)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+flask_app.before_request_funcs.setdefault(None, []).insert(0, use_async_session)
+app = AsyncServer(flask_app)
@@ -0,0 +1,107 @@
+"""
+JWT handling on top of flask_jwt_extended.
+
+`TokenCache` remembers the claims of tokens whose signature was already checked, so a
+client sending the same token again skips the decode and signature check; only the
+expiry is checked again on a hit. `CachedJWTManager` is a JWTManager that uses it.
+
+`setup_auth(app)` adds the sliding refresh: a response to a request that authenticated
+with a token close to expiring carries a new one in the `X-Access-Token` header, which
+the client should use from then on. Requests that didn't authenticate are skipped
+without touching the token at all.
+
+    JWT_CACHE_SIZE=1024       verified tokens kept per worker (0 to verify every time)
+    JWT_CACHE_TTL=300         seconds a verified token is trusted without checking its
+                              signature again (never past its expiry)
+    JWT_REFRESH_MINUTES=60    tokens expiring within this many minutes get refreshed
+"""
+import os
+import time
+from flask_jwt_extended import JWTManager, create_access_token, get_jwt
+from flask_jwt_extended.config import config
+from cache import LRUCache, NullCache
+
+class TokenCache:
+    def __init__(self, maxsize=1024, ttl=300):
+        self.verified = LRUCache(maxsize=maxsize, ttl=ttl)
+        # jti of a refreshed token -> the token that replaces it
+        self.replacements = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    # The claims of `token` if it was verified before and is still valid
+    def get(self, token):
+        claims = self.verified.get(token)
+        if claims is None:
+            self.misses += 1
+            return None
+        now = time.time()
+        leeway = config.leeway
+        if claims.get('exp', now) + leeway < now or claims.get('nbf', now) - leeway > now:
+            # Decoded again, to raise the error flask_jwt_extended expects
+            self.verified.delete(token)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return claims
+
+    def set(self, token, claims):
+        self.verified.set(token, claims)
+
+    # The new token for the current one, minted once and then reused so requests in
+    # the refresh window don't sign one each
+    def refreshed(self, claims):
+        token = self.replacements.get(claims['jti']) if 'jti' in claims else None
+        if token is None:
+            token = create_access_token(identity=claims.get(config.identity_claim_key))
+            self.refreshes += 1
+            if 'jti' in claims:
+                self.replacements.set(claims['jti'], token)
+        return token
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "refreshes": self.refreshes,
+        }
+
+token_cache = TokenCache()
+
+class CachedJWTManager(JWTManager):
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        # Cookie tokens are checked against their CSRF value every time
+        if csrf_value is not None or allow_expired:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+        claims = token_cache.get(encoded_token)
+        if claims is None:
+            claims = super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+            token_cache.set(encoded_token, claims)
+        # A copy, so a caller changing it can't change what the next request gets
+        return dict(claims)
+
+REFRESH_WINDOW = 60 * 60
+
+def refresh_expiring_jwt(response):
+    # Set by jwt_required once a token was verified (empty with optional=True); on
+    # every other request get_jwt() raises instead.
+    try:
+        claims = get_jwt()
+    except RuntimeError:
+        return response
+    if claims and claims.get('type', 'access') == 'access' and claims.get('exp', float('inf')) - time.time() < REFRESH_WINDOW:
+        response.headers['X-Access-Token'] = token_cache.refreshed(claims)
+    return response
+
+def setup_auth(app):
+    global REFRESH_WINDOW
+    size = int(os.environ.get('JWT_CACHE_SIZE', 1024))
+    ttl = int(os.environ.get('JWT_CACHE_TTL', 300))
+    token_cache.verified = LRUCache(maxsize=size, ttl=ttl) if size > 0 else NullCache()
+    token_cache.replacements = LRUCache(maxsize=size, ttl=ttl) if size > 0 else NullCache()
+    REFRESH_WINDOW = int(os.environ.get('JWT_REFRESH_MINUTES', 60)) * 60
+    app.after_request(refresh_expiring_jwt)
+    app.extensions['token_cache'] = token_cache
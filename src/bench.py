@@ -0,0 +1,702 @@
+"""
+Benchmarks for the API.
+
+    $ pipenv run bench recommend --games 10000
+    $ pipenv run bench serialize --rows 20000 --collection user_games
+    $ pipenv run bench auth --requests 2000
+    $ pipenv run bench login --seconds 5 --logins 4 --readers 4
+    $ pipenv run bench --output main.json routes --db file --users 200
+    $ pipenv run bench serve --concurrency 1,10,50,200 --latency-ms 5
+    $ pipenv run bench compare main.json branch.json
+
+`routes` seeds a fresh SQLite database (in memory, or a temporary file with --db file)
+with seed.py and sends every route in main.py through the Flask test client, one
+request at a time, reporting p50/p99 latency, requests per second and SQL statements
+per request for each.
+
+`serve` is a load test of the two ways to run the app: gunicorn with one gthread
+worker (wsgi.py) and uvicorn with one worker (asgi.py), each in a process of its own on
+a seeded SQLite file. Every SQL statement there is delayed by --latency-ms, as if the
+database were across the network. For each --concurrency it keeps that many
+connections busy with profile and backlog reads and platform writes, and reports
+requests per second and p50/p99 latency per server.
+
+Each benchmark prints its timings and returns them as a dict; --output also saves them
+as JSON, along with the commit they were measured on, for `compare`.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+def timed(fn, repeat):
+    """Best wall time of `repeat` runs of fn(), and its last result"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def bench_recommend(args):
+    import numpy as np
+    from recommend import preference_vector, score, score_naive
+
+    rng = random.Random(args.seed)
+    genre_ids = range(1, 60)
+    tag_ids = range(1, 5000)
+    candidates = [
+        {"game_id": n, "genres": rng.sample(genre_ids, 3), "tags": rng.sample(tag_ids, 15)}
+        for n in range(args.games)
+    ]
+    pref_keys, pref_weights = preference_vector(
+        [str(x) for x in rng.sample(genre_ids, 5)], [str(x) for x in rng.sample(genre_ids, 3)],
+        [str(x) for x in rng.sample(tag_ids, 200)], [str(x) for x in rng.sample(tag_ids, 100)])
+
+    vectorized, fast = timed(lambda: score(candidates, pref_keys, pref_weights), args.repeat)
+    naive, slow = timed(lambda: score_naive(candidates, pref_keys, pref_weights), args.repeat)
+    if not np.allclose(fast, slow):
+        raise SystemExit('vectorized and naive scores differ')
+
+    results = {
+        "games": args.games,
+        "vectorized_ms": vectorized * 1000,
+        "naive_ms": naive * 1000,
+        "speedup": naive / vectorized,
+    }
+    print('recommend: %d games  vectorized %.2f ms  naive loop %.2f ms  (%.1fx)' % (
+        args.games, results["vectorized_ms"], results["naive_ms"], results["speedup"]))
+    return results
+
+def bench_serialize(args):
+    import json as stdlib_json
+    # Must be set before the app is imported: never seed a real database
+    os.environ['DB_CONNECTION_STRING'] = 'sqlite://'
+    from main import app
+    from models import db, User, Game, Backlog, Platform
+    from encoding import dumps, orjson
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(id=1, email='bench@example.com', username='bench', password='x'))
+        model = User.child_model(args.collection)
+        if model is Backlog:
+            db.session.execute(Game.__table__.insert(), [{"game_id": str(n), "game_name": 'Game %d' % n, "game_image": 'https://example.com/%d.jpg' % n} for n in range(1000)])
+            rows = [{"user_id": 1, "game_id": str(n % 1000), "game_status": 'playing'} for n in range(args.rows)]
+        elif model is Platform:
+            rows = [{"user_id": 1, "platform_id": str(n), "platform_name": 'Platform %d' % n} for n in range(args.rows)]
+        else:
+            rows = [model.insert_row({"user_id": 1, model.id_field: str(n), model.name_field: 'Name %d' % n}) for n in range(args.rows)]
+        db.session.execute(model.__table__.insert(), rows)
+        db.session.commit()
+
+        query = model.query.filter_by(user_id=1).order_by(model.id)
+        compact = {"sort_keys": True, "separators": (',', ':')}
+
+        def orm_path():
+            # What the list endpoints used to do: ORM objects, serialize(), stdlib JSON
+            db.session.expunge_all()
+            return stdlib_json.dumps(list(map(lambda x: x.serialize(), query)), **compact)
+
+        def columns_stdlib():
+            return stdlib_json.dumps(model.json_rows(model.json_query(query)), **compact)
+
+        def columns_fast():
+            return dumps(model.json_rows(model.json_query(query)))
+
+        paths = [('orm + serialize + json', orm_path), ('columns + json', columns_stdlib)]
+        if orjson is not None:
+            paths.append(('columns + orjson', columns_fast))
+        results = {"rows": args.rows, "collection": args.collection}
+        expected = None
+        for name, fn in paths:
+            best, output = timed(fn, args.repeat)
+            if expected is None:
+                expected = stdlib_json.loads(output)
+            elif stdlib_json.loads(output) != expected:
+                raise SystemExit('%s returned something else than the ORM path' % name)
+            results[name] = args.rows / best
+            print('serialize %s: %-24s %10.0f rows/s  (%.2f ms)' % (args.collection, name, args.rows / best, best * 1000))
+        return results
+
+def bench_auth(args):
+    # Must be set before the app is imported: never seed a real database
+    os.environ['DB_CONNECTION_STRING'] = 'sqlite://'
+    from flask_jwt_extended import create_access_token
+    from main import app, jwt
+    from auth import token_cache
+    from cache import LRUCache, NullCache
+
+    client = app.test_client()
+    with app.test_request_context():
+        token = create_access_token(identity=1)
+    headers = {"Authorization": 'Bearer %s' % token}
+    cached = LRUCache(maxsize=1024, ttl=300)
+
+    def decode(n):
+        with app.test_request_context():
+            for _ in range(n):
+                jwt._decode_jwt_from_config(token)
+
+    def requests(n, path, headers=None):
+        for _ in range(n):
+            client.get(path, headers=headers).close()
+
+    def uncached(fn):
+        def run():
+            token_cache.verified = NullCache()
+            try:
+                fn()
+            finally:
+                token_cache.verified = cached
+        return run
+
+    n = args.requests
+    paths = [
+        ('decode, verified', uncached(lambda: decode(n))),
+        ('decode, cached', lambda: decode(n)),
+        # Same route, turned away before any token is decoded
+        ('request, no token', lambda: requests(n, '/protected')),
+        ('request, verified', uncached(lambda: requests(n, '/protected', headers))),
+        ('request, cached', lambda: requests(n, '/protected', headers)),
+    ]
+    token_cache.verified = cached
+    results = {"requests": n}
+    for name, fn in paths:
+        best, _ = timed(fn, args.repeat)
+        results[name] = best / n * 1e6
+        print('auth: %-20s %8.1f us' % (name, best / n * 1e6))
+    results["request overhead, verified"] = results["request, verified"] - results["request, no token"]
+    results["request overhead, cached"] = results["request, cached"] - results["request, no token"]
+    print('auth overhead per request: %.1f us verified, %.1f us cached' % (results["request overhead, verified"], results["request overhead, cached"]))
+    return results
+
+def bench_login(args):
+    # A file, so the threads get connections of their own; never a real database
+    directory = tempfile.mkdtemp(prefix='bench-')
+    os.environ['DB_CONNECTION_STRING'] = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    import threading
+    from main import app
+    from models import db
+    from passwords import hasher
+    from seed import seed, SEED_PASSWORD
+
+    def worker(stop, path, body, latencies, statuses):
+        client = app.test_client()
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = client.post(path, json=body) if body is not None else client.get(path)
+            response.close()
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    def run(logins, workers):
+        hasher.configure(algorithm=hasher.algorithm, scrypt_n=args.cost, pbkdf2_iterations=args.cost, workers=workers)
+        stop = threading.Event()
+        reads, login_times = [], []
+        read_statuses, login_statuses = {}, {}
+        threads = [threading.Thread(target=worker, args=(stop, '/user/%d/backlog' % user_ids[n % len(user_ids)], None, reads, read_statuses)) for n in range(args.readers)]
+        threads += [threading.Thread(target=worker, args=(stop, '/login', {"username": 'seed%d' % n, "password": SEED_PASSWORD}, login_times, login_statuses)) for n in range(logins)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        reads.sort()
+        return {
+            "reads_per_second": len(reads) / args.seconds,
+            "read_p50_ms": percentile(reads, 50) * 1000 if reads else None,
+            "read_p99_ms": percentile(reads, 99) * 1000 if reads else None,
+            "logins_per_second": login_statuses.get(200, 0) / args.seconds,
+            "login_statuses": dict((str(status), n) for status, n in sorted(login_statuses.items())),
+        }
+
+    try:
+        with app.app_context():
+            db.create_all()
+            user_ids = seed(max(args.logins, 10), 20, 3, 10, 200, args.seed)
+        results = {"algorithm": hasher.algorithm, "cost": args.cost, "readers": args.readers, "logins": args.logins}
+        for name, logins, workers in (('no logins', 0, args.workers), ('logins in request threads', args.logins, 0), ('logins on the pool', args.logins, args.workers)):
+            results[name] = result = run(logins, workers)
+            print('login: %-26s reads %7.0f/s  p50 %7.2f ms  p99 %7.2f ms   logins %6.1f/s  %s' % (
+                name, result["reads_per_second"], result["read_p50_ms"], result["read_p99_ms"], result["logins_per_second"],
+                ' '.join('%s:%d' % item for item in result["login_statuses"].items())))
+        return results
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list"""
+    return values[max(0, min(len(values) - 1, int(math.ceil(p / 100.0 * len(values))) - 1))]
+
+def route_requests(rng, user_ids, token):
+    """(label, request) pairs, one per route and method; request() returns client.open keywords"""
+    from models import db, Backlog, Platform, GenreLike, GenreDislike, TagLike, TagDislike
+    from seed import SEED_PASSWORD
+
+    counter = iter(range(1000000, sys.maxsize))
+
+    def user():
+        return rng.choice(user_ids)
+
+    def owned(model, count=1):
+        # Existing rows of a random user, looked up before (and not timed with) the request
+        while True:
+            user_id = user()
+            ids = [id for (id,) in db.session.query(model.id).filter(model.user_id == user_id)]
+            if len(ids) >= count:
+                db.session.rollback()
+                return user_id, rng.sample(ids, count)
+
+    def game():
+        n = next(counter)
+        return {"game_id": str(n), "game_name": 'Bench Game %d' % n, "game_image": 'https://example.com/games/%d.jpg' % n}
+
+    def get(path):
+        return lambda: {"method": 'GET', "path": path()}
+
+    def post(path, body):
+        return lambda: {"method": 'POST', "path": path(), "json": body()}
+
+    def delete(model, path):
+        def request():
+            user_id, (id,) = owned(model)
+            return {"method": 'DELETE', "path": path % (user_id, id)}
+        return request
+
+    def bulk_ids(model, method, path, extra=None):
+        def request():
+            user_id, ids = owned(model, 5)
+            body = {"ids": ids}
+            body.update(extra() if extra is not None else {})
+            return {"method": method, "path": path % user_id, "json": body}
+        return request
+
+    def update_backlog():
+        user_id, (id,) = owned(Backlog)
+        return {"method": 'PUT', "path": '/user/%d/updatebl/%d' % (user_id, id), "json": {"game_status": rng.choice(('playing', 'finished'))}}
+
+    def login():
+        return {"method": 'POST', "path": '/login', "json": {"username": 'seed%d' % rng.randrange(len(user_ids)), "password": SEED_PASSWORD}}
+
+    def register():
+        n = next(counter)
+        return {"method": 'POST', "path": '/register', "json": {"email": 'bench%d@example.com' % n, "username": 'bench%d' % n, "password": 'bench'}}
+
+    def recommendations():
+        games = [{"game_id": n, "genres": rng.sample(range(1, 60), 3), "tags": rng.sample(range(1, 5000), 15)} for n in range(200)]
+        return {"method": 'POST', "path": '/user/%d/recommendations' % user(), "json": {"games": games, "limit": 20}}
+
+    def preference(model):
+        def body():
+            n = next(counter)
+            return {model.id_field: str(n), model.name_field: 'Bench %d' % n}
+        return body
+
+    def preference_bulk(model):
+        return lambda: [preference(model)() for _ in range(20)]
+
+    def backlog_item():
+        item = game()
+        item["game_status"] = 'wishlist'
+        return item
+
+    requests = [
+        ('sitemap', get(lambda: '/')),
+        ('register', register),
+        ('login', login),
+        ('protected', lambda: {"method": 'GET', "path": '/protected', "headers": {"Authorization": 'Bearer %s' % token}}),
+        ('protected (POST)', lambda: {"method": 'POST', "path": '/protected', "headers": {"Authorization": 'Bearer %s' % token}}),
+        ('all users', get(lambda: '/users')),
+        ('user by name', get(lambda: '/user/seed%d' % rng.randrange(len(user_ids)))),
+        ('user by id', get(lambda: '/user/%d' % user())),
+        ('profile', get(lambda: '/user/%d/profile' % user())),
+        ('changes', get(lambda: '/user/%d/changes' % user())),
+        ('cache stats', get(lambda: '/cache/stats')),
+        ('metrics', get(lambda: '/metrics')),
+        ('backlog', get(lambda: '/user/%d/backlog' % user())),
+        ('backlog search', get(lambda: '/user/%d/backlog?q=quest&sort=name&limit=20' % user())),
+        ('add to backlog', post(lambda: '/user/%d/backlog' % user(), backlog_item)),
+        ('update backlog', update_backlog),
+        ('remove from backlog', delete(Backlog, '/user/%d/removebl/%d')),
+        ('platforms', get(lambda: '/user/%d/platforms' % user())),
+        ('add platform', post(lambda: '/user/%d/platforms' % user(), lambda: {"platform_id": str(next(counter)), "platform_name": 'Bench'})),
+        ('remove platform', delete(Platform, '/user/%d/platforms/%d')),
+    ]
+    for model, segment, remove in ((GenreLike, 'genrelikes', 'degl'), (GenreDislike, 'genredislikes', 'degd'), (TagLike, 'taglike', 'detl'), (TagDislike, 'tagdislike', 'detd')):
+        requests += [
+            (segment, get(lambda segment=segment: '/user/%d/%s' % (user(), segment))),
+            ('add ' + segment, post(lambda segment=segment: '/user/%d/%s' % (user(), segment), preference(model))),
+            ('remove ' + segment, delete(model, '/user/%%d/%s/%%d' % remove)),
+        ]
+    requests += [
+        ('bulk add taglike', post(lambda: '/user/%d/taglike/bulk' % user(), preference_bulk(TagLike))),
+        ('bulk add backlog', post(lambda: '/user/%d/backlog/bulk' % user(), lambda: [backlog_item() for _ in range(20)])),
+        ('bulk update backlog', bulk_ids(Backlog, 'PUT', '/user/%d/backlog/bulk', lambda: {"game_status": 'finished'})),
+        ('bulk remove genrelikes', bulk_ids(GenreLike, 'DELETE', '/user/%d/genrelikes/bulk')),
+        ('recommendations', recommendations),
+    ]
+    return requests
+
+def bench_routes(args):
+    # Must be set before the app is imported: never seed a real database
+    directory = None
+    if args.db == 'file':
+        directory = tempfile.mkdtemp(prefix='bench-')
+        os.environ['DB_CONNECTION_STRING'] = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    else:
+        os.environ['DB_CONNECTION_STRING'] = 'sqlite://'
+    from sqlalchemy import event
+    from main import app
+    from models import db
+    from seed import seed, SEED_PASSWORD
+
+    rng = random.Random(args.seed)
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    try:
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            user_ids = seed(args.users, args.backlog, args.platforms, args.likes, args.games, args.seed)
+            seeded = time.perf_counter() - start
+            print('seeded %d users in %.2f s (%s)' % (len(user_ids), seeded, args.db))
+            event.listen(db.engine, 'after_cursor_execute', count)
+
+            client = app.test_client()
+            token = client.post('/login', json={"username": 'seed0', "password": SEED_PASSWORD}).get_json()['token']
+            adapter = app.url_map.bind('localhost')
+            results = {"db": args.db, "users": args.users, "backlog": args.backlog, "platforms": args.platforms, "likes": args.likes, "games": args.games, "seed_seconds": seeded, "routes": {}}
+            missed = set((rule.endpoint, method) for rule in app.url_map.iter_rules()
+                         if app.view_functions[rule.endpoint].__module__ == 'main' for method in rule.methods - {'HEAD', 'OPTIONS'})
+
+            for label, request in route_requests(rng, user_ids, token):
+                times = []
+                counts = []
+                statuses = {}
+                for n in range(args.warmup + args.requests):
+                    kwargs = request()
+                    statements[0] = 0
+                    start = time.perf_counter()
+                    response = client.open(**kwargs)
+                    response.get_data()
+                    response.close()
+                    elapsed = time.perf_counter() - start
+                    if n < args.warmup:
+                        continue
+                    times.append(elapsed)
+                    counts.append(statements[0])
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                rule, _ = adapter.match(kwargs['path'].split('?')[0], kwargs['method'], return_rule=True)
+                missed.discard((rule.endpoint, kwargs['method']))
+                times.sort()
+                route = {
+                    "route": '%s %s' % (kwargs['method'], rule.rule),
+                    "requests": len(times),
+                    "p50_ms": percentile(times, 50) * 1000,
+                    "p99_ms": percentile(times, 99) * 1000,
+                    "mean_ms": sum(times) / len(times) * 1000,
+                    "requests_per_second": len(times) / sum(times),
+                    "statements_mean": sum(counts) / float(len(counts)),
+                    "statements_max": max(counts),
+                    "statuses": dict((str(status), n) for status, n in sorted(statuses.items())),
+                }
+                results["routes"][label] = route
+                print('%-24s %-7s p50 %8.2f ms  p99 %8.2f ms  %8.0f req/s  %5.1f SQL  %s' % (
+                    label, kwargs['method'], route["p50_ms"], route["p99_ms"], route["requests_per_second"], route["statements_mean"],
+                    ' '.join('%s:%d' % item for item in route["statuses"].items())))
+            for endpoint, method in sorted(missed):
+                print('not benchmarked: %s %s' % (method, endpoint))
+            return results
+    finally:
+        if directory is not None:
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+def bench_server(args):
+    """One server process for `serve`; runs until it is terminated"""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from sqlalchemy.util import await_only
+
+    delay = args.latency_ms / 1000.0
+
+    # Before every statement, on every engine: a sleep in the thread, or a wait that
+    # gives the event loop back under the async engine
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def latency(conn, *args):
+        if conn.dialect.is_async:
+            await_only(asyncio.sleep(delay))
+        else:
+            time.sleep(delay)
+
+    if args.kind == 'asgi':
+        import uvicorn
+        from asgi import app
+        uvicorn.run(app, host='127.0.0.1', port=args.port, log_level='warning', access_log=False)
+        return {}
+
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in (('bind', '127.0.0.1:%d' % args.port), ('workers', 1), ('worker_class', 'gthread'),
+                               ('threads', args.threads), ('loglevel', 'warning'), ('keepalive', 5)):
+                self.cfg.set(key, value)
+
+        def load(self):
+            from main import app
+            return app
+
+    Server().run()
+    return {}
+
+async def read_response(reader):
+    """(status, whether the server closes the connection) of one HTTP/1.1 response"""
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    return status, headers.get('connection') == 'close'
+
+async def load_test(port, connections, seconds, next_request):
+    """Keeps `connections` keep-alive connections busy for `seconds`"""
+    latencies = []
+    statuses = {}
+    deadline = time.perf_counter() + seconds
+
+    async def client():
+        reader = writer = None
+        while time.perf_counter() < deadline:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            method, path, body = next_request()
+            data = json.dumps(body).encode('utf-8') if body is not None else b''
+            head = '%s %s HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n' % (method, path, len(data))
+            start = time.perf_counter()
+            try:
+                writer.write(head.encode('latin-1') + data)
+                status, close = await read_response(reader)
+            except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+                status, close = 'error', True
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            if close:
+                writer.close()
+                writer = None
+        if writer is not None:
+            writer.close()
+
+    await asyncio.gather(*(client() for _ in range(connections)))
+    latencies.sort()
+    return {
+        "requests_per_second": len(latencies) / seconds,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "statuses": dict((str(status), n) for status, n in sorted(statuses.items(), key=str)),
+    }
+
+def bench_serve(args):
+    # A file both servers open; never a real database
+    directory = tempfile.mkdtemp(prefix='bench-')
+    database = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    os.environ['DB_CONNECTION_STRING'] = database
+    from main import app
+    from models import db
+    from seed import seed
+
+    rng = random.Random(args.seed)
+    counter = iter(range(1000000, sys.maxsize))
+    levels = [int(n) for n in args.concurrency.split(',')]
+
+    def next_request():
+        user_id = rng.choice(user_ids)
+        if rng.random() < args.writes:
+            n = next(counter)
+            return 'POST', '/user/%d/platforms' % user_id, {"platform_id": str(n), "platform_name": 'Bench %d' % n}
+        return 'GET', rng.choice(('/user/%d/profile', '/user/%d/backlog')) % user_id, None
+
+    def free_port():
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            return s.getsockname()[1]
+
+    def wait_until_up(name, port, server):
+        deadline = time.time() + 30
+        while time.time() < deadline and server.poll() is None:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise SystemExit('the %s server did not start' % name)
+
+    servers = (('gthread', 'wsgi.py on gunicorn, 1 worker x %d threads' % args.threads), ('asgi', 'asgi.py on uvicorn, 1 worker'))
+    try:
+        with app.app_context():
+            db.create_all()
+            user_ids = seed(args.users, args.backlog, 3, 10, 1000, args.seed)
+        results = {"latency_ms": args.latency_ms, "users": args.users, "writes": args.writes, "threads": args.threads, "servers": {}}
+        for name, description in servers:
+            port = free_port()
+            command = [sys.executable, os.path.abspath(__file__), 'server', name, '--port', str(port), '--latency-ms', str(args.latency_ms), '--threads', str(args.threads)]
+            server = subprocess.Popen(command, env=dict(os.environ, DB_CONNECTION_STRING=database), cwd=os.path.dirname(os.path.abspath(__file__)))
+            try:
+                wait_until_up(name, port, server)
+                print('%s: %s' % (name, description))
+                # Untimed, to fill the caches and the pool
+                asyncio.run(load_test(port, 1, 1, next_request))
+                results["servers"][name] = levels_run = {}
+                for connections in levels:
+                    levels_run[str(connections)] = result = asyncio.run(load_test(port, connections, args.seconds, next_request))
+                    print('  %4d connections  %8.0f req/s  p50 %8.2f ms  p99 %8.2f ms  %s' % (
+                        connections, result["requests_per_second"], result["p50_ms"], result["p99_ms"],
+                        ' '.join('%s:%d' % item for item in result["statuses"].items())))
+            finally:
+                server.terminate()
+                server.wait()
+        for connections in levels:
+            gthread, asgi = (results["servers"][name][str(connections)]["requests_per_second"] for name, _ in servers)
+            print('%4d connections: asgi %.1fx the requests per second of gthread' % (connections, asgi / gthread if gthread else float('inf')))
+        return results
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+def environment():
+    """What the results were measured on"""
+    from importlib import metadata
+
+    def git(*args):
+        try:
+            return subprocess.check_output(('git',) + args, stderr=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "commit": git('rev-parse', 'HEAD'),
+        "branch": git('rev-parse', '--abbrev-ref', 'HEAD'),
+        "python": platform.python_version(),
+        "flask": metadata.version('flask'),
+        "sqlalchemy": metadata.version('sqlalchemy'),
+        "time": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+def bench_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    print('%s (%s) -> %s (%s)' % (args.baseline, baseline.get("environment", {}).get("commit"), args.candidate, candidate.get("environment", {}).get("commit")))
+    results = {}
+    for label, new in candidate["results"].get("routes", {}).items():
+        old = baseline["results"].get("routes", {}).get(label)
+        if old is None:
+            continue
+        results[label] = change = {
+            "p50": new["p50_ms"] / old["p50_ms"],
+            "p99": new["p99_ms"] / old["p99_ms"],
+            "statements": new["statements_mean"] - old["statements_mean"],
+        }
+        print('%-24s p50 %8.2f -> %8.2f ms (%5.2fx)  p99 %8.2f -> %8.2f ms (%5.2fx)  SQL %+.1f' % (
+            label, old["p50_ms"], new["p50_ms"], change["p50"], old["p99_ms"], new["p99_ms"], change["p99"], change["statements"]))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement, the best one counts')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='also save the results to this JSON file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    recommend = commands.add_parser('recommend', help='vectorized vs. per-row recommendation scoring')
+    recommend.add_argument('--games', type=int, default=10000)
+    recommend.set_defaults(run=bench_recommend)
+
+    serialize = commands.add_parser('serialize', help='ORM objects + serialize() vs. column rows + fast JSON for a list GET')
+    serialize.add_argument('--rows', type=int, default=20000)
+    serialize.add_argument('--collection', default='user_games', choices=('user_games', 'user_platforms', 'genres_liked', 'genres_disliked', 'tags_liked', 'tags_disliked'))
+    serialize.set_defaults(run=bench_serialize)
+
+    auth = commands.add_parser('auth', help='per-request cost of checking a JWT, with and without the verified-token cache')
+    auth.add_argument('--requests', type=int, default=2000)
+    auth.set_defaults(run=bench_auth)
+
+    login = commands.add_parser('login', help='backlog reads while other threads log in, hashing inline vs. on the bounded pool')
+    login.add_argument('--seconds', type=float, default=5)
+    login.add_argument('--readers', type=int, default=4, help='threads reading a backlog')
+    login.add_argument('--logins', type=int, default=4, help='threads logging in')
+    login.add_argument('--workers', type=int, default=1, help='size of the hashing pool')
+    login.add_argument('--cost', type=int, default=16384, help='scrypt N (or PBKDF2 iterations)')
+    login.set_defaults(run=bench_login)
+
+    routes = commands.add_parser('routes', help='latency, throughput and SQL statements of every route, on seeded data')
+    routes.add_argument('--db', choices=('memory', 'file'), default='memory', help='SQLite in memory or in a temporary file')
+    routes.add_argument('--requests', type=int, default=20, help='timed requests per route')
+    routes.add_argument('--warmup', type=int, default=2, help='untimed requests per route first')
+    routes.add_argument('--users', type=int, default=20, help='GET /users reads every one of them')
+    routes.add_argument('--backlog', type=int, default=20, help='backlog games per user')
+    routes.add_argument('--platforms', type=int, default=3, help='platforms per user')
+    routes.add_argument('--likes', type=int, default=10, help='ids per user in each genre/tag like and dislike collection')
+    routes.add_argument('--games', type=int, default=1000, help='games in the catalog')
+    routes.set_defaults(run=bench_routes)
+
+    serve = commands.add_parser('serve', help='load test of the gthread (wsgi.py) and asgi (asgi.py) servers, with simulated database latency')
+    serve.add_argument('--concurrency', default='1,10,50,200', help='comma separated numbers of connections to keep busy')
+    serve.add_argument('--seconds', type=float, default=5, help='per server and number of connections')
+    serve.add_argument('--latency-ms', type=float, default=5, help='added to every SQL statement')
+    serve.add_argument('--threads', type=int, default=4, help='gthread threads, as GUNICORN_THREADS')
+    serve.add_argument('--writes', type=float, default=0.1, help='share of requests that add a platform')
+    serve.add_argument('--users', type=int, default=100)
+    serve.add_argument('--backlog', type=int, default=20, help='backlog games per user')
+    serve.set_defaults(run=bench_serve)
+
+    server = commands.add_parser('server', help='one server of `serve`, until it is terminated')
+    server.add_argument('kind', choices=('gthread', 'asgi'))
+    server.add_argument('--port', type=int, default=3000)
+    server.add_argument('--latency-ms', type=float, default=5, help='added to every SQL statement')
+    server.add_argument('--threads', type=int, default=4, help='gthread threads')
+    server.set_defaults(run=bench_server)
+
+    compare = commands.add_parser('compare', help='route timings of two --output files')
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.set_defaults(run=bench_compare)
+
+    args = parser.parse_args(argv)
+    results = args.run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"benchmark": args.command, "environment": environment(), "results": results}, f, indent=2, sort_keys=True)
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Read cache for the per-user collections (backlog, platforms, genre/tag likes and dislikes).
+
+Entries are keyed by (user_id, collection) and hold the serialized list exactly as the
+GET handler returns it, stamped with the user's version (User.version, which every write
+to their collections bumps) read before it was loaded. A read passes the version it has
+just read and only takes an entry with that same stamp, so an entry loaded before a
+write is never served after it, whichever process or worker wrote and cached.
+Handlers that write a collection also call `user_cache.invalidate(user_id, collection)`
+once their transaction has committed, which frees the entry straight away.
+
+The backend is picked from the environment by `setup_cache(app)`:
+
+    CACHE_BACKEND=memory   bounded in-process LRU with a TTL (default)
+    CACHE_BACKEND=redis    shared between every gunicorn worker, needs `redis` installed
+                           and CACHE_REDIS_URL
+    CACHE_BACKEND=none     no caching
+
+    CACHE_MAXSIZE=4096     entries kept by the memory backend
+    CACHE_TTL=300          seconds an entry lives in either backend
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from flask import json
+from replicas import read_from_replica
+
+try:
+    import redis
+except ImportError:  # only needed for CACHE_BACKEND=redis
+    redis = None
+
+class LRUCache:
+    def __init__(self, maxsize=4096, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+class RedisCache:
+    def __init__(self, url, ttl=300, prefix='hexbreak:user'):
+        if redis is None:
+            raise RuntimeError('CACHE_BACKEND=redis needs the redis package installed.')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, key):
+        return '%s:%s' % (self.prefix, ':'.join(str(part) for part in key))
+
+    def get(self, key):
+        value = self.client.get(self._key(key))
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self.client.setex(self._key(key), self.ttl, json.dumps(value))
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+class UserCache:
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else LRUCache()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_or_load(self, user_id, collection, version, load):
+        return self.get_or_load_many(user_id, [collection], version, lambda missing: {collection: load()})[collection]
+
+    # `version` is the user's version, read before anything is loaded (None for no
+    # user: nothing is cached then). `load` gets the list of collections that missed
+    # and returns a dict with their values, so several of them can be read from the
+    # database together.
+    def get_or_load_many(self, user_id, collections, version, load):
+        found = {}
+        missing = []
+        for collection in collections:
+            value = self._get(user_id, collection, version)
+            if value is None:
+                missing.append(collection)
+            else:
+                found[collection] = value
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            loaded = load(missing)
+            self.store(user_id, loaded, version)
+            found.update(loaded)
+        return found
+
+    def _get(self, user_id, collection, version):
+        if version is None:
+            return None
+        entry = self.backend.get((user_id, collection))
+        # Loaded at another version: before a write, or before one this read hasn't seen
+        if entry is None or entry[0] != version:
+            return None
+        return entry[1]
+
+    # Which of `collections` aren't cached at `version`, without counting it as a
+    # lookup (to load them ahead of the request that reads them, see asgi.py)
+    def uncached(self, user_id, collections, version):
+        return [collection for collection in collections if self._get(user_id, collection, version) is None]
+
+    # Caches the collections a load returned, under the version read before it. A
+    # replica may be behind the primary: what came from one is not kept.
+    def store(self, user_id, loaded, version):
+        if version is None or read_from_replica():
+            return
+        for collection, value in loaded.items():
+            self.backend.set((user_id, collection), (version, value))
+
+    def invalidate(self, user_id, *collections):
+        self.invalidations += 1
+        for collection in collections:
+            self.backend.delete((user_id, collection))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+user_cache = UserCache()
+
+def setup_cache(app):
+    ttl = int(os.environ.get('CACHE_TTL', 300))
+    backend = os.environ.get('CACHE_BACKEND', 'memory')
+    if backend == 'memory':
+        user_cache.backend = LRUCache(maxsize=int(os.environ.get('CACHE_MAXSIZE', 4096)), ttl=ttl)
+    elif backend == 'redis':
+        user_cache.backend = RedisCache(os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0'), ttl=ttl)
+    elif backend == 'none':
+        user_cache.backend = NullCache()
+    else:
+        raise RuntimeError('Unknown CACHE_BACKEND %r' % backend)
+    app.extensions['user_cache'] = user_cache
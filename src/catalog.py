@@ -0,0 +1,111 @@
+"""
+In-process cache of the shared game catalog (`Game`: name and image per game_id).
+
+Backlog rows only store the game_id, and every user with the same game shares its
+catalog entry, so serializing a backlog mostly hits this cache instead of the
+database. A complete entry is written once (see `Game.remember`) and never changes
+through the API, so each worker keeps its own copy. An entry still missing its name
+or image can be filled in by a later writer, so it is read from the database every
+time instead of being cached. Edits in the admin drop the entry from the editing
+worker's cache; other workers pick them up within CATALOG_TTL.
+
+When Backlog rows are loaded they register their game_id as wanted; the first
+lookup that misses then fetches every wanted id with one "WHERE game_id IN (...)"
+query, so a cold page of N rows costs one query instead of N.
+
+    CATALOG_MAXSIZE=10000  games kept per worker
+    CATALOG_TTL=3600       seconds an entry lives
+"""
+import os
+import threading
+from cache import LRUCache
+
+LOAD_BATCH = 500
+# Wanted ids beyond this are dropped; they are fetched one batch at a time on a miss instead
+MAX_PENDING = 5000
+
+NO_GAME = {"game_name": None, "game_image": None}
+
+class GameCatalog:
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else LRUCache(maxsize=10000, ttl=3600)
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def want(self, game_id):
+        if game_id is None or len(self._pending) >= MAX_PENDING:
+            return
+        if self.backend.get(game_id) is None:
+            with self._lock:
+                self._pending.add(game_id)
+
+    def get(self, game_id):
+        if game_id is None:
+            return NO_GAME
+        game = self.backend.get(game_id)
+        if game is not None:
+            self.hits += 1
+            return game
+        self.misses += 1
+        with self._lock:
+            wanted = self._pending | {game_id}
+            self._pending = set()
+        # Not in the catalog at all: nothing to show, and nothing is cached for it
+        return self.load(wanted).get(game_id, NO_GAME)
+
+    # game_id -> entry for a whole batch, fetching the uncached ones together
+    def get_many(self, game_ids):
+        found = {}
+        missing = set()
+        for game_id in set(game_ids):
+            if game_id is None:
+                continue
+            game = self.backend.get(game_id)
+            if game is None:
+                missing.add(game_id)
+            else:
+                found[game_id] = game
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            loaded = self.load(missing)
+            for game_id in missing:
+                found[game_id] = loaded.get(game_id, NO_GAME)
+        return found
+
+    # game_id -> entry for the ids found in the catalog; the complete ones are cached
+    def load(self, game_ids):
+        from models import db, Game
+
+        game_ids = list(game_ids)
+        loaded = {}
+        for start in range(0, len(game_ids), LOAD_BATCH):
+            self.loads += 1
+            rows = db.session.query(Game.game_id, Game.game_name, Game.game_image).filter(Game.game_id.in_(game_ids[start:start + LOAD_BATCH]))
+            for game_id, game_name, game_image in rows:
+                loaded[game_id] = {"game_name": game_name, "game_image": game_image}
+                if game_name is not None and game_image is not None:
+                    self.backend.set(game_id, loaded[game_id])
+        return loaded
+
+    def invalidate(self, game_id):
+        self.backend.delete(game_id)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "loads": self.loads,
+            "size": len(self.backend),
+        }
+
+game_catalog = GameCatalog()
+
+def setup_catalog(app):
+    game_catalog.backend = LRUCache(maxsize=int(os.environ.get('CATALOG_MAXSIZE', 10000)), ttl=int(os.environ.get('CATALOG_TTL', 3600)))
+    app.extensions['game_catalog'] = game_catalog
@@ -0,0 +1,30 @@
+"""
+Flask CLI commands, registered on the app by setup_commands(app).
+
+    $ pipenv run rebuild-preferences
+    $ pipenv run seed --users 1000
+"""
+import click
+from models import PreferenceSet
+from seed import seed
+
+def setup_commands(app):
+
+    @app.cli.command('rebuild-preferences')
+    @click.option('--batch-size', default=1000, show_default=True, help='Users rebuilt per transaction.')
+    def rebuild_preferences(batch_size):
+        """Recompute every user's preference set from the like/dislike tables."""
+        total = PreferenceSet.rebuild(batch_size)
+        click.echo('Rebuilt the preference sets of %d users.' % total)
+
+    @app.cli.command('seed')
+    @click.option('--users', default=100, show_default=True, help='Users to add.')
+    @click.option('--backlog', default=20, show_default=True, help='Backlog games per user.')
+    @click.option('--platforms', default=3, show_default=True, help='Platforms per user.')
+    @click.option('--likes', default=10, show_default=True, help='Ids per user in each genre/tag like and dislike collection.')
+    @click.option('--games', default=1000, show_default=True, help='Games in the shared catalog.')
+    @click.option('--seed', 'random_seed', default=42, show_default=True, help='Random seed; the same one writes the same data.')
+    def seed_command(users, backlog, platforms, likes, games, random_seed):
+        """Add synthetic users and collections for benchmarks and local testing."""
+        user_ids = seed(users, backlog, platforms, likes, games, random_seed)
+        click.echo('Seeded %d users (%d games in the catalog).' % (len(user_ids), games))
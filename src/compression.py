@@ -0,0 +1,119 @@
+"""
+Response compression, negotiated from Accept-Encoding: brotli when the `brotli`
+package is installed and the client takes it, gzip otherwise.
+
+`setup_compression(app)` hooks it into every response, so handlers don't change.
+Only complete (not streamed) 200 responses of a compressible type above a minimum
+size are compressed. Compressed bodies are cached by their ETag (the user's data
+version, see main.user_etag) or, for responses without one, by a hash of the body,
+so repeat reads of unchanged data aren't compressed again. Responses read from a
+replica (see replicas.py) are compressed every time.
+
+A compressed response gets its own ETag, the plain one plus "-gzip" / "-br", as
+a strong ETag must differ per content coding; `etag_variants` lists them so
+If-None-Match can match any of them.
+
+    COMPRESS_MIN_SIZE=1024         bytes below which responses are sent as they are
+    COMPRESS_LEVEL=6               gzip level, 1-9
+    COMPRESS_BROTLI_QUALITY=5      brotli quality, 0-11
+    COMPRESS_CACHE_SIZE=256        compressed bodies kept per worker
+"""
+import gzip
+import hashlib
+import os
+from flask import request
+from cache import LRUCache
+from replicas import read_from_replica
+
+try:
+    import brotli
+except ImportError:  # only needed to offer br
+    brotli = None
+
+COMPRESSIBLE = ('application/json', 'application/x-ndjson', 'application/javascript', 'text/')
+
+def etag_variants(etag):
+    return [etag] + ['%s-%s' % (etag, encoding) for encoding in ('br', 'gzip')]
+
+class Compressor:
+    def __init__(self, min_size=1024, level=6, brotli_quality=5, cache_size=256):
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.cache = LRUCache(maxsize=cache_size, ttl=3600)
+        self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+        self.compressed = 0
+        self.cache_hits = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def negotiate(self):
+        return request.accept_encodings.best_match(self.encodings)
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.level)
+
+    def after_request(self, response):
+        if 'Content-Encoding' in response.headers:
+            return response
+        etag, weak = response.get_etag()
+
+        if response.status_code == 304:
+            # Answered from the client's copy: tell it which variant it has
+            if etag is not None:
+                for variant in etag_variants(etag)[1:]:
+                    if variant in request.if_none_match:
+                        response.set_etag(variant, weak)
+            return response
+        if response.status_code != 200 or response.is_streamed or response.direct_passthrough:
+            return response
+        if not (response.mimetype or '').startswith(COMPRESSIBLE):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.negotiate()
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        cached = not read_from_replica()
+        key = (etag if etag is not None and not weak else hashlib.sha1(data).hexdigest(), encoding)
+        body = self.cache.get(key) if cached else None
+        if body is None:
+            body = self.compress(data, encoding)
+            if cached:
+                self.cache.set(key, body)
+            self.compressed += 1
+        else:
+            self.cache_hits += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(body)
+
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        if etag is not None:
+            response.set_etag('%s-%s' % (etag, encoding), weak)
+        return response
+
+    def stats(self):
+        return {
+            "encodings": self.encodings,
+            "compressed": self.compressed,
+            "cache_hits": self.cache_hits,
+            "ratio": self.bytes_out / self.bytes_in if self.bytes_in else 1.0,
+        }
+
+compressor = Compressor()
+
+def setup_compression(app):
+    compressor.min_size = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    compressor.level = int(os.environ.get('COMPRESS_LEVEL', 6))
+    compressor.brotli_quality = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+    compressor.cache = LRUCache(maxsize=int(os.environ.get('COMPRESS_CACHE_SIZE', 256)), ttl=3600)
+    # after_request hooks run in reverse order of registration: set up before the
+    # others so the body is compressed after they are done with it
+    app.after_request(compressor.after_request)
+    app.extensions['compressor'] = compressor
@@ -0,0 +1,92 @@
+"""
+Engine and connection pool settings from the environment: `engine_options(uri)` is what
+main.py passes as SQLALCHEMY_ENGINE_OPTIONS.
+
+    DB_POOL_SIZE=5               connections kept open per worker process
+    DB_MAX_OVERFLOW=10           extra connections opened under load, closed once returned
+    DB_POOL_TIMEOUT=30           seconds a request waits for a connection before failing
+    DB_POOL_RECYCLE=1800         seconds before a connection is replaced (keep it below
+                                 MySQL's wait_timeout)
+    DB_POOL_PRE_PING=1           check a connection is alive before handing it out
+    DB_STATEMENT_TIMEOUT_MS=0    cancel statements running longer than this (PostgreSQL,
+                                 and SELECTs on MySQL); 0 for no limit
+
+A request holds at most one connection, so a worker needs about as many as it has
+threads (GUNICORN_THREADS, see gunicorn.conf.py), and workers x (size + overflow) has
+to stay under the server's max_connections. SQLite keeps SQLAlchemy's default pool.
+Served by asgi.py, a worker has one more pool of the same size for its async engine,
+and size + overflow is what caps the requests querying at once.
+
+The pool times every checkout: /metrics has the wait (hexbreak_db_pool_wait_seconds),
+timeouts, and the connections in use. Waits that grow with load mean the pool is too
+small for the concurrency; timeouts, that it is far too small.
+"""
+import os
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from metrics import metrics
+
+class TimedPool:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        metrics.pools.add(self)
+
+    # Includes opening a new connection when the pool has room for one
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            metrics.pool_timeouts += 1
+            raise
+        finally:
+            metrics.observe_checkout(time.perf_counter() - start)
+
+class TimedQueuePool(TimedPool, QueuePool):
+    pass
+
+# For the async engine of asgi.py
+class TimedAsyncQueuePool(TimedPool, AsyncAdaptedQueuePool):
+    pass
+
+def _mysql_statement_timeout(milliseconds):
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SET SESSION max_execution_time = %d' % milliseconds)
+        cursor.close()
+    return connect
+
+def engine_options(uri, poolclass=TimedQueuePool):
+    uri = uri or ''
+    if uri.startswith('sqlite'):
+        return {}
+    options = {
+        "poolclass": poolclass,
+        "pool_size": int(os.environ.get('DB_POOL_SIZE', 5)),
+        "max_overflow": int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        "pool_timeout": float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        "pool_recycle": int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        "pool_pre_ping": os.environ.get('DB_POOL_PRE_PING', '1') not in ('0', 'false', 'no'),
+    }
+    timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    if timeout and uri.startswith('postgresql+asyncpg'):
+        options["connect_args"] = {"server_settings": {"statement_timeout": str(timeout)}}
+    elif timeout and uri.startswith('postgres'):
+        options["connect_args"] = {"options": '-c statement_timeout=%d' % timeout}
+    elif timeout and uri.startswith('mysql'):
+        # Not every MySQL driver takes an init_command (mysql-connector-python 8.0 has
+        # none), so the engine gets a pool class of its own to run it on connect:
+        # listening on `poolclass` itself would add to every engine, once per call
+        options["poolclass"] = type(poolclass.__name__, (poolclass,), {})
+        event.listen(options["poolclass"], 'connect', _mysql_statement_timeout(timeout))
+    return options
+
+# For gunicorn's post_fork: connections opened by the master (preload_app) must not be
+# shared with the workers, so each worker starts with an empty pool
+def dispose_after_fork(app, db):
+    with app.app_context():
+        try:
+            db.engine.dispose(close=False)
+        except TypeError:  # SQLAlchemy < 1.4.33: drops the master's connections
+            db.engine.dispose()
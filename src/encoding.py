@@ -0,0 +1,62 @@
+"""
+JSON encoding for responses: orjson when it is installed (`pip install orjson`, several
+times faster on long lists), the standard library otherwise.
+
+`setup_json(app)` plugs it in as the app's JSON provider, so `jsonify`, `flask.json`
+and the streamed lists all use it. Flask versions before 2.2 have no providers; there
+only `json_response` (used by the list endpoints) gets the fast encoder.
+
+Request bodies are still parsed by the standard library: orjson rejects integers
+beyond 64 bits, which the handlers answer with their own errors. For the same reason
+a response holding one (echoed from a request) is encoded by the standard library.
+"""
+from flask import current_app, json, Response
+
+try:
+    import orjson
+except ImportError:  # optional, see above
+    orjson = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:  # Flask < 2.2
+    DefaultJSONProvider = None
+
+if orjson is not None:
+    # Dates go through Flask's own encoder, so they keep their format
+    OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+def _default(value):
+    if DefaultJSONProvider is not None:
+        return DefaultJSONProvider.default(value)
+    return current_app.json_encoder().default(value)
+
+def dumps(value):
+    if orjson is None:
+        return json.dumps(value)
+    try:
+        return orjson.dumps(value, default=_default, option=OPTIONS | orjson.OPT_SORT_KEYS).decode('utf-8')
+    except orjson.JSONEncodeError:
+        return json.dumps(value)
+
+def json_response(value, status=200):
+    return Response(dumps(value) + '\n', status=status, mimetype='application/json')
+
+if orjson is not None and DefaultJSONProvider is not None:
+    class ORJSONProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            option = OPTIONS
+            if kwargs.get('sort_keys', self.sort_keys):
+                option |= orjson.OPT_SORT_KEYS
+            if kwargs.get('indent'):
+                option |= orjson.OPT_INDENT_2
+            if set(kwargs) - {'sort_keys', 'indent', 'separators'}:
+                return super().dumps(obj, **kwargs)
+            try:
+                return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+            except orjson.JSONEncodeError:
+                return super().dumps(obj, **kwargs)
+
+def setup_json(app):
+    if orjson is not None and DefaultJSONProvider is not None:
+        app.json = ORJSONProvider(app)
@@ -0,0 +1,57 @@
+"""
+Production settings for gunicorn, from the environment:
+
+    $ gunicorn --config src/gunicorn.conf.py --chdir src wsgi
+
+    GUNICORN_WORKER_CLASS=gthread   sync: one request per process at a time
+                                    gthread: GUNICORN_THREADS requests per process
+                                    gevent: many requests per process on greenlets; needs
+                                    `gevent` installed and a driver that cooperates with it
+                                    (psycopg2 with psycogreen, or a pure Python one such as
+                                    mysql-connector), or each query blocks the whole process
+                                    uvicorn.workers.UvicornWorker: asgi.py (run asgi:app
+                                    instead of wsgi), needs `uvicorn`, see asgi.py
+    WEB_CONCURRENCY=<2 x cores + 1> worker processes (1 x cores for gthread and gevent)
+    GUNICORN_THREADS=4              threads per worker for gthread
+    GUNICORN_CONNECTIONS=100        greenlets per worker for gevent
+    GUNICORN_TIMEOUT=30             seconds before a silent worker is restarted
+    GUNICORN_MAX_REQUESTS=2000      requests before a worker is replaced (0 for never)
+    GUNICORN_PRELOAD=1              import the app once in the master, then fork
+    PORT=3000
+
+The workers share the master's copy of the app with preload_app, but not its database
+connections: post_fork empties the connection pool in each worker (see database.py for
+the pool settings; a worker needs about one connection per thread or greenlet that
+queries at the same time).
+"""
+import multiprocessing
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class == 'gevent':
+    # Before anything imports socket or threading, i.e. before the app is preloaded
+    from gevent import monkey
+    monkey.patch_all()
+
+cores = multiprocessing.cpu_count()
+workers = int(os.environ.get('WEB_CONCURRENCY', cores * 2 + 1 if worker_class == 'sync' else cores))
+threads = int(os.environ.get('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+worker_connections = int(os.environ.get('GUNICORN_CONNECTIONS', 100))
+bind = '0.0.0.0:%s' % os.environ.get('PORT', 3000)
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = timeout
+keepalive = 5
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') not in ('0', 'false', 'no')
+# Heartbeat files in memory rather than on a possibly slow disk (Docker, Heroku)
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+accesslog = '-'
+
+def post_fork(server, worker):
+    if preload_app:
+        from database import dispose_after_fork
+        from replicas import replicas
+        from main import app, db
+        dispose_after_fork(app, db)
+        replicas.dispose(close=False)
@@ -2,38 +2,61 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
+import hashlib
 from flask import Flask, request, jsonify, url_for, make_response
 from flask_migrate import Migrate
+from sqlalchemy import func
 from flask_swagger import swagger
 from flask_cors import CORS
 from flask_jwt_extended import create_access_token
 from flask_jwt_extended import get_jwt_identity
 from flask_jwt_extended import jwt_required
-from flask_jwt_extended import JWTManager
-from flask_jwt_extended import get_jwt
 from flask_jwt_extended import set_access_cookies
 from flask_jwt_extended import unset_jwt_cookies
 from utils import APIException, generate_sitemap
+from pagination import list_response, stream_format
+from cache import user_cache, setup_cache
+from catalog import game_catalog, setup_catalog
+from encoding import json_response, setup_json
+from passwords import hasher, setup_passwords
+from auth import token_cache, CachedJWTManager, setup_auth
+from metrics import metrics, setup_metrics
+from database import engine_options
+from replicas import replicas, setup_replicas
+from compression import compressor, etag_variants, setup_compression
+from recommend import preference_vector, rank
+from preferences import unpack
 from admin import setup_admin
-from models import db, User, Platform, Backlog, GenreLike, GenreDislike, TagLike, TagDislike
-from datetime import datetime
+from commands import setup_commands
+from models import db, include_object, upsert, upsert_one, update_owned, delete_owned, User, Platform, Game, Backlog, Preference, GenreLike, GenreDislike, TagLike, TagDislike, Tombstone, PreferenceSet
 from datetime import timedelta
-from datetime import timezone
 #from models import Person
 
 app = Flask(__name__)
 app.url_map.strict_slashes = False
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_CONNECTION_STRING')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config["JWT_COOKIE_SECURE"] = True
 app.config["JWT_TOKEN_LOCATION"] = ["headers"]
 app.config["JWT_SECRET_KEY"] = "game-finder"  # Change this!
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=3)
-jwt = JWTManager(app)
-MIGRATE = Migrate(app, db)
+# flask_jwt_extended >= 4.6 rejects the integer identities /login issues
+app.config["JWT_VERIFY_SUB"] = False
+jwt = CachedJWTManager(app)
+MIGRATE = Migrate(app, db, include_object=include_object)
 db.init_app(app)
-CORS(app)
+setup_replicas(app)
+CORS(app, expose_headers=['X-Access-Token', 'X-Next-Cursor'])
 setup_admin(app)
+setup_cache(app)
+setup_catalog(app)
+setup_json(app)
+setup_metrics(app)
+setup_compression(app)
+setup_auth(app)
+setup_passwords(app)
+setup_commands(app)
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
@@ -45,21 +68,6 @@ def handle_invalid_usage(error):
 def sitemap():
     return generate_sitemap(app)
 
-# Using an `after_request` callback, we refresh any token that is within 30
-# minutes of expiring. Change the timedeltas to match the needs of your application.
-@app.after_request
-def refresh_expiring_jwts(response):
-    try:
-        exp_timestamp = get_jwt()["exp"]
-        now = datetime.now(timezone.utc)
-        target_timestamp = datetime.timestamp(now + timedelta(hours=1))
-        if target_timestamp > exp_timestamp:
-            access_token = create_access_token(identity=get_jwt_identity())
-        return response
-    except (RuntimeError, KeyError):
-        # Case where there is not a valid JWT. Just return the original respone
-        return response
-
 @app.route("/register", methods=["POST"])
 def register():
     email = request.json.get('email', None)
@@ -72,8 +80,10 @@ def register():
         return "Missing username", 400
     if not password:
         return "Missing password", 400
+    if not isinstance(password, str):
+        return "Password must be a string", 400
 
-    newUser = User(email=email, username=username, password=password)
+    newUser = User(email=email, username=username, password=hasher.hash(password))
     db.session.add(newUser)
     db.session.commit()
 
@@ -86,10 +96,24 @@ def login():
     credentials = request.json
     username = credentials.get("username", None)
     password = credentials.get("password", None)
-    user = User.query.filter_by(username=username, password=password).first()
+    if not isinstance(password, str):
+        return jsonify("Invalid email or password."), 400
+    user = db.session.query(User.id, User.password).filter_by(username=username).first()
+    # Give the connection back while the password is checked
+    db.session.rollback()
     if user is None:
+        matches, rehash = hasher.check_unknown(password)
+    else:
+        user_id, stored = user
+        matches, rehash = hasher.check(password, stored)
+    if not matches:
         return jsonify("Invalid email or password."), 400
-    access_token = create_access_token(identity=user.id)
+    if rehash:
+        # A plain password from before hashing, or a hash with a lower cost: replace it,
+        # unless it was changed in the meantime
+        db.session.query(User).filter_by(id=user_id, password=stored).update({"password": hasher.hash(password)}, synchronize_session=False)
+        db.session.commit()
+    access_token = create_access_token(identity=user_id)
     response = {"token" : access_token}
     return jsonify(response)
 
@@ -100,86 +124,307 @@ def login():
 def protected():
     # Access the identity of the current user with get_jwt_identity
     current_user = get_jwt_identity()
-    print(current_user)
     return jsonify({"user_id" : current_user}), 200
 
+# Which user keys to serialize, from the optional query parameters
+#   ?fields=id,username          only these keys (collections included)
+#   ?include=user_games,...      which collections to add to `base` (empty for none)
+# Returns the keys and the collections among them, which are the only ones loaded.
+def requested_user_fields(base=User.fields, args=None):
+    args = request.args if args is None else args
+    fields = args.get('fields')
+    include = args.get('include')
+    if fields is None and include is None:
+        return base + User.collections, User.collections
+
+    names = []
+    for value in (fields, include):
+        if value:
+            names.extend(name.strip() for name in value.split(',') if name.strip())
+    unknown = [name for name in names if name not in User.fields + User.collections]
+    if unknown:
+        raise APIException('Unknown field(s): %s' % ', '.join(unknown), status_code=400)
+
+    if fields is None:
+        names = list(base) + names
+    # Keep the canonical key order and drop duplicates
+    keys = tuple(name for name in User.fields + User.collections if name in names)
+    return keys, tuple(name for name in keys if name in User.collections)
+
 # This get method grabs EVERYTHING we have collected from the Users.
 @app.route('/users', methods=['GET'])
 def get_all_users():
 
-    allusers = User.query.all()
-    response_body = list(map(lambda x: x.serialize(), allusers))
+    fields, collections = requested_user_fields()
+    allusers = User.query.options(*User.eager(collections))
 
-    if response_body is None:
-        raise APIException('You should not be seeing this. Check the route for errors.', status_code=400)
-
-    return jsonify(response_body), 200
+    return list_response(allusers, User.id, lambda x: x.serialize(fields))
 
 # Get Username by Username
 @app.route('/user/<username>', methods=['GET'])
 def obtain_username(username):
 
-    body = request.get_json()
-    get_user = User.query.filter_by(username=username)
+    fields, collections = requested_user_fields()
+    get_user = User.query.options(*User.eager(collections)).filter_by(username=username)
     if get_user is None:
         raise APIException('Username does not exist.', status_code=404)
-    response_body = list(map(lambda x: x.serialize(), get_user))
+    response_body = list(map(lambda x: x.serialize(fields), get_user))
     
     return jsonify(response_body), 200
 
 # Get User by ID
 @app.route('/user/<int:user_id>', methods=['GET'])
 def id_username(user_id):
-    body = request.get_json()
-    get_user = User.query.get(user_id)
-    if get_user is None:
-        raise APIException('Username does not exist.', status_code=404) 
-    response_body = get_user.serialize()
-    
+    fields, collections = requested_user_fields()
+
+    def build(version):
+        get_user = User.query.options(*User.eager(collections)).get(user_id)
+        if get_user is None:
+            raise APIException('Username does not exist.', status_code=404) 
+        response_body = get_user.serialize(fields)
+
+        return jsonify(response_body), 200
+
+    return conditional_response(user_id, build)
+
+# The user's version counter, which every write to their collections bumps (None for
+# no such user)
+def user_version(user_id):
+    return db.session.query(User.version).filter_by(id=user_id).scalar()
+
+# Bumps the user's version for a write, see User.bump_version. No user row means no
+# such user: nothing is written and the client gets the 404 the GETs give.
+def bump_user_version(user_id):
+    version = User.bump_version(user_id)
+    if version is None:
+        db.session.rollback()
+        raise APIException('Username does not exist.', status_code=404)
+    return version
+
+# Strong ETag for a read of the user's data at `version`, plus a digest of the exact
+# request so different pages, fields and formats never share a tag.
+def user_etag(user_id, version):
+    if version is None:
+        return None
+    variant = request.full_path + '|' + request.headers.get('Accept', '')
+    return '%d.%d.%s' % (user_id, version, hashlib.sha1(variant.encode('utf-8')).hexdigest()[:12])
+
+# Answers If-None-Match with a 304 before `build(version)` loads or serializes anything.
+# The version is read first: a write landing in between only makes the tag older
+# than the body, which costs the client a re-download, never a stale 304. For the
+# same reason it is the version cached collections are read and stored at.
+def conditional_response(user_id, build):
+    version = user_version(user_id)
+    etag = user_etag(user_id, version)
+    # The client may hold the compressed variant, which has its own ETag
+    if etag is not None and any(variant in request.if_none_match for variant in etag_variants(etag)):
+        response = make_response('', 304)
+    else:
+        response = make_response(build(version))
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+# A collection's items as its GET endpoint returns them, read through the user cache
+# at the user's `version`
+def cached_collection(user_id, collection, version, query=None):
+    model = User.child_model(collection)
+    if query is None:
+        query = model.query.filter_by(user_id=user_id)
+    return user_cache.get_or_load(user_id, collection, version, lambda: model.json_rows(model.json_query(query).order_by(model.id)))
+
+# Collections of the user straight from the database, as their GET endpoints return
+# them. The preference ones are read together with a single scan of the preference table.
+def load_collections(user_id, collections):
+    loaded = {}
+    kinds = [name for name in collections if issubclass(User.child_model(name), Preference)]
+    if len(kinds) > 1:
+        models = dict(((model.pref_kind, model.pref_polarity), model) for model in map(User.child_model, kinds))
+        rows = dict((model, []) for model in models.values())
+        scan = db.session.query(Preference.kind, Preference.polarity, Preference.id, Preference.user_id, Preference.external_id, Preference.name)
+        for row in scan.filter(Preference.user_id == user_id).order_by(Preference.id):
+            if (row[0], row[1]) in models:
+                rows[models[row[0], row[1]]].append(row[2:])
+        for name in kinds:
+            model = User.child_model(name)
+            loaded[name] = model.json_rows(rows[model])
+    for name in collections:
+        if name not in loaded:
+            model = User.child_model(name)
+            loaded[name] = model.json_rows(model.json_query(model.query.filter_by(user_id=user_id)).order_by(model.id))
+    return loaded
+
+# Several collections at once, those that miss the cache loaded together
+def cached_collections(user_id, collections, version):
+    return user_cache.get_or_load_many(user_id, collections, version, lambda missing: load_collections(user_id, missing))
+
+# Plain GETs of a collection are served from the cache; paginated or streamed ones
+# (including a stream asked for with only the Accept header) go to the database.
+def collection_response(user_id, collection, query):
+    model = User.child_model(collection)
+    if request.args or stream_format() is not None:
+        return conditional_response(user_id, lambda version: list_response(model.json_query(query), model.id, serialize_many=model.json_rows))
+    return conditional_response(user_id, lambda version: (json_response(cached_collection(user_id, collection, version, query)), 200))
+
+# Everything the frontend shows after login in one round trip: id, username and the
+# six collections, read from the user cache or the database. ?include= /
+# ?fields= select sections like on /user/<id>.
+@app.route('/user/<int:user_id>/profile', methods=['GET'])
+def user_profile(user_id):
+    fields, collections = requested_user_fields(base=('id', 'username'))
+
+    def build(version):
+        get_user = User.query.get(user_id)
+        if get_user is None:
+            raise APIException('Username does not exist.', status_code=404)
+        response_body = get_user.serialize([name for name in fields if name not in collections])
+        sections = cached_collections(user_id, collections, version)
+        for name in collections:
+            # Copies: the cached items are shared and must not lose their user_id
+            response_body[name] = [{k: v for k, v in item.items() if k != 'user_id'} for item in sections[name]]
+
+        return jsonify(response_body), 200
+
+    return conditional_response(user_id, build)
+
+# Delta sync: every row written and every row deleted in the user's collections after
+# version `since`. Without `since` the whole of each collection comes back. The
+# returned cursor is the `since` to send next time. Clients apply "deleted" before
+# "upserted": a database may hand a deleted row's id to a newer row.
+@app.route('/user/<int:user_id>/changes', methods=['GET'])
+def user_changes(user_id):
+    since = request.args.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            raise APIException('since must be an integer.', status_code=400)
+        # Past a BIGINT the drivers fail before the database sees the query
+        if not -2**63 <= since < 2**63:
+            raise APIException('since must be an integer.', status_code=400)
+
+    # The cursor is the version conditional_response read first: rows written
+    # meanwhile are sent again next time, which is harmless, instead of being skipped.
+    def build(cursor):
+        if cursor is None:
+            raise APIException('Username does not exist.', status_code=404)
+        changes = {}
+        for name in User.collections:
+            model = User.child_model(name)
+            query = model.query.filter(model.user_id == user_id)
+            if since is not None:
+                query = query.filter(model.version > since)
+            changes[name] = {"upserted": model.json_rows(model.json_query(query).order_by(model.id)), "deleted": []}
+        if since is not None:
+            deleted = db.session.query(Tombstone.collection, Tombstone.row_id).filter(Tombstone.user_id == user_id, Tombstone.version > since)
+            live = dict((name, set(item["id"] for item in section["upserted"])) for name, section in changes.items())
+            for collection, row_id in deleted.order_by(Tombstone.id):
+                # Ids can be reused (the preference table renumbered them): a live row wins
+                if row_id not in live[collection]:
+                    changes[collection]["deleted"].append(row_id)
+
+        return jsonify({"cursor": cursor, "changes": changes}), 200
+
+    return conditional_response(user_id, build)
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    response_body = user_cache.stats()
+    response_body["catalog"] = game_catalog.stats()
+    response_body["compression"] = compressor.stats()
+    response_body["auth"] = token_cache.stats()
+    response_body["passwords"] = hasher.stats()
+    response_body["replicas"] = replicas.stats()
     return jsonify(response_body), 200
 
+# Latency, SQL statements and response size per endpoint, for Prometheus
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return metrics.response()
+
+# Filters for GET /user/<id>/backlog, on top of ?limit / ?after / ?stream:
+#   ?status=playing,finished   game_status is one of these
+#   ?q=zeld                    game name contains this (case-insensitive)
+#   ?prefix=the leg            game name starts with this
+#   ?sort=name                 id (default), name or status; "-name" for descending
+BACKLOG_FILTERS = ('status', 'q', 'prefix', 'sort')
+BACKLOG_SORTS = {
+    'id': Backlog.id,
+    'name': func.lower(func.coalesce(Game.game_name, ''), type_=db.String),
+    'status': func.coalesce(Backlog.game_status, ''),
+}
+
 # Backlog Post (Add) / Get (Obtain)
 @app.route('/user/<int:user_id>/backlog', methods=['POST', 'GET'])
 def get_backlog(user_id):
 
-    body = request.get_json()
-
     if request.method == 'POST':
-        addbacklog = Backlog(user_id=user_id, game_name=body['game_name'], game_id=body['game_id'], game_image=body['game_image'], game_status=body['game_status'])
+        body = request.get_json()
+        Game.remember([{"game_id": body['game_id'], "game_name": body['game_name'], "game_image": body['game_image']}])
+        addbacklog = Backlog(user_id=user_id, game_id=body['game_id'], game_status=body['game_status'])
+        addbacklog.version = bump_user_version(user_id)
         db.session.add(addbacklog)
         db.session.commit()
+        user_cache.invalidate(user_id, 'user_games')
         response_body = addbacklog.serialize()
         
         return jsonify(response_body), 200
 
     if request.method == 'GET':
         getbacklog = Backlog.query.filter_by(user_id=user_id)
-        response_body = list(map(lambda x: x.serialize(), getbacklog))
-
-        return jsonify(response_body), 200
+        if not any(name in request.args for name in BACKLOG_FILTERS):
+            return collection_response(user_id, 'user_games', getbacklog)
+
+        status = request.args.get('status')
+        if status:
+            getbacklog = getbacklog.filter(Backlog.game_status.in_(status.split(',')))
+        search, prefix = request.args.get('q'), request.args.get('prefix')
+        sort = request.args.get('sort', 'id')
+        descending = sort.startswith('-')
+        if sort.lstrip('-') not in BACKLOG_SORTS:
+            raise APIException('sort must be one of %s, optionally with a leading "-".' % ', '.join(BACKLOG_SORTS), status_code=400)
+        sort = BACKLOG_SORTS[sort.lstrip('-')]
+        if search or prefix:
+            getbacklog = getbacklog.join(Game, Game.game_id == Backlog.game_id)
+            if search:
+                getbacklog = getbacklog.filter(Game.name_matches(search))
+            if prefix:
+                getbacklog = getbacklog.filter(Game.name_matches(prefix, prefix=True))
+        elif sort is BACKLOG_SORTS['name']:
+            getbacklog = getbacklog.outerjoin(Game, Game.game_id == Backlog.game_id)
+
+        # Plain id order is what list_response does anyway, with a shorter cursor
+        order = None if sort is Backlog.id and not descending else (sort, descending)
+        return conditional_response(user_id, lambda version: list_response(Backlog.json_query(getbacklog), Backlog.id, sort=order, serialize_many=Backlog.json_rows))
 
     return "Ok!", 200
 
 # Backlog PUT (Update)
+# Name and image belong to the shared catalog entry of a game_id, which keeps the copy
+# it was first given: they are only taken along with the game_id they describe
+def check_catalog_fields(body):
+    if "game_id" not in body and ("game_name" in body or "game_image" in body):
+        raise APIException('game_name and game_image can only be sent along with a game_id.', status_code=400)
+
 @app.route('/user/<int:user_id>/updatebl/<int:id>', methods=['PUT'])
 def update_backlog(user_id, id):
 
     body = request.get_json()
 
     if request.method == 'PUT':
-        updatebacklog = Backlog.query.get(id)
+        check_catalog_fields(body)
+        changes = {key: body[key] for key in ('game_id', 'game_status') if key in body}
+        if "game_id" in body:
+            Game.remember([{"game_id": body["game_id"], "game_name": body.get("game_name"), "game_image": body.get("game_image")}])
+        changes['version'] = bump_user_version(user_id)
+        # One UPDATE ... WHERE id AND user_id ... RETURNING: ownership is checked by the write
+        updatebacklog = update_owned(Backlog, id, user_id, changes)
         if updatebacklog is None:
+            db.session.rollback()
             raise APIException('ID not found', status_code=404)
-        if "game_name" in body:
-            updatebacklog.game_name = body["game_name"]
-        if "game_id" in body:
-            updatebacklog.game_id = body["game_id"]
-        if "game_image" in body:
-            updatebacklog.game_image = body["game_image"]
-        if "game_status" in body:
-            updatebacklog.game_status = body["game_status"]
         db.session.commit()
-        response_body = updatebacklog.serialize()
+        response_body = Backlog(**updatebacklog).serialize()
+        user_cache.invalidate(user_id, 'user_games')
 
     return jsonify(response_body), 200
 
@@ -187,11 +432,11 @@ def update_backlog(user_id, id):
 @app.route('/user/<int:user_id>/removebl/<int:id>', methods=['DELETE'])
 def new_backlog(user_id, id):
     
-    deletebacklog = Backlog.query.get(id)
-    # if deletebacklog is None:
-    #     raise APIException('ID not found', status_code=404)
-    db.session.delete(deletebacklog)
+    if delete_owned(Backlog, id, user_id) is None:
+        raise APIException('ID not found', status_code=404)
+    Tombstone.record(user_id, 'user_games', id)
     db.session.commit()
+    user_cache.invalidate(user_id, 'user_games')
 
     return jsonify('Deletion Successful'), 200
 
@@ -199,21 +444,21 @@ def new_backlog(user_id, id):
 @app.route('/user/<int:user_id>/platforms', methods=['POST', 'GET'])
 def addget_platform(user_id):
 
-    body = request.get_json()
-
     if request.method == 'POST':
+        body = request.get_json()
         addplatform = Platform(user_id=user_id, platform_name=body['platform_name'], platform_id=body['platform_id'])
-        db.session.add(addplatform)
+        addplatform.version = bump_user_version(user_id)
+        upsert_one(addplatform)
         db.session.commit()
+        user_cache.invalidate(user_id, 'user_platforms')
         response_body = addplatform.serialize()
 
         return jsonify(response_body), 200
     
     if request.method == 'GET':
         getplatforms = db.session.query(Platform).filter(Platform.user_id == user_id)
-        response_body = list(map(lambda x: x.serialize(), getplatforms))
 
-        return jsonify(response_body), 200
+        return collection_response(user_id, 'user_platforms', getplatforms)
 
     return "All Good!", 200
 
@@ -221,11 +466,12 @@ def addget_platform(user_id):
 @app.route('/user/<int:user_id>/platforms/<int:id>', methods=['DELETE'])
 def remove_platform(user_id, id):
 
-    removeplatform = Platform.query.get(id)
+    removeplatform = delete_owned(Platform, id, user_id)
     if removeplatform is None:
         raise APIException('ID not found', status_code=404)
-    db.session.delete(removeplatform)
+    Tombstone.record(user_id, 'user_platforms', id)
     db.session.commit()
+    user_cache.invalidate(user_id, 'user_platforms')
 
     return jsonify('Deletion Successful'), 200
 
@@ -233,21 +479,22 @@ def remove_platform(user_id, id):
 @app.route('/user/<int:user_id>/genrelikes', methods=['POST', 'GET'])
 def addget_genrelikes(user_id):
 
-    body = request.get_json()
-
     if request.method == 'POST':
+        body = request.get_json()
         addlike = GenreLike(user_id=user_id, genre_name=body['genre_name'], genre_id=body['genre_id'])
-        db.session.add(addlike)
+        addlike.version = bump_user_version(user_id)
+        upsert_one(addlike)
+        PreferenceSet.sync(user_id, 'genres_liked', [addlike.genre_id])
         db.session.commit()
+        user_cache.invalidate(user_id, 'genres_liked')
         response_body = addlike.serialize()
 
         return jsonify(response_body), 200
 
     if request.method == 'GET':
         getlikedlist = GenreLike.query.filter_by(user_id=user_id)
-        response_body = list(map(lambda x: x.serialize(), getlikedlist))
 
-        return jsonify(response_body), 200
+        return collection_response(user_id, 'genres_liked', getlikedlist)
 
     return "Ok!", 200
 
@@ -255,11 +502,13 @@ def addget_genrelikes(user_id):
 @app.route('/user/<int:user_id>/degl/<int:id>', methods=['DELETE'])
 def remove_genrelikes(user_id, id):
 
-    removelike = GenreLike.query.get(id)
+    removelike = delete_owned(GenreLike, id, user_id)
     if removelike is None:
         raise APIException('ID not found', status_code=404)
-    db.session.delete(removelike)
+    Tombstone.record(user_id, 'genres_liked', id)
+    PreferenceSet.sync(user_id, 'genres_liked', [removelike['external_id']])
     db.session.commit()
+    user_cache.invalidate(user_id, 'genres_liked')
 
     return jsonify('Deletion successful'), 200
 
@@ -267,21 +516,22 @@ def remove_genrelikes(user_id, id):
 @app.route('/user/<int:user_id>/genredislikes', methods=['POST', 'GET'])
 def addget_genredislikes(user_id):
 
-    body = request.get_json()
-
     if request.method == 'POST':
+        body = request.get_json()
         addislike = GenreDislike(user_id=user_id, genre_name=body['genre_name'], genre_id=body['genre_id'])
-        db.session.add(addislike)
+        addislike.version = bump_user_version(user_id)
+        upsert_one(addislike)
+        PreferenceSet.sync(user_id, 'genres_disliked', [addislike.genre_id])
         db.session.commit()
+        user_cache.invalidate(user_id, 'genres_disliked')
         response_body = addislike.serialize()
 
         return jsonify(response_body), 200
 
     if request.method == 'GET':
         getdislikedlist = GenreDislike.query.filter_by(user_id=user_id)
-        response_body = list(map(lambda x: x.serialize(), getdislikedlist))
 
-        return jsonify(response_body), 200
+        return collection_response(user_id, 'genres_disliked', getdislikedlist)
 
     return "Ok!", 200
 
@@ -289,11 +539,13 @@ def addget_genredislikes(user_id):
 @app.route('/user/<int:user_id>/degd/<int:id>', methods=['DELETE'])
 def remove_genredislikes(user_id, id):
 
-    removedislike = GenreDislike.query.get(id)
+    removedislike = delete_owned(GenreDislike, id, user_id)
     if removedislike is None:
         raise APIException('ID not found', status_code=404)
-    db.session.delete(removedislike)
+    Tombstone.record(user_id, 'genres_disliked', id)
+    PreferenceSet.sync(user_id, 'genres_disliked', [removedislike['external_id']])
     db.session.commit()
+    user_cache.invalidate(user_id, 'genres_disliked')
 
     return jsonify('Deletion successful'), 200
 
@@ -301,21 +553,22 @@ def remove_genredislikes(user_id, id):
 @app.route('/user/<int:user_id>/taglike', methods=['POST', 'GET'])
 def postget_taglike(user_id):
 
-    body = request.get_json()
-
     if request.method == 'POST':
+        body = request.get_json()
         addlike = TagLike(user_id=user_id, tag_name=body['tag_name'], tag_id=body['tag_id'])
-        db.session.add(addlike)
+        addlike.version = bump_user_version(user_id)
+        upsert_one(addlike)
+        PreferenceSet.sync(user_id, 'tags_liked', [addlike.tag_id])
         db.session.commit()
+        user_cache.invalidate(user_id, 'tags_liked')
         response_body = addlike.serialize()
 
         return jsonify(response_body), 200
 
     if request.method == 'GET':
         getlikedlist = TagLike.query.filter_by(user_id=user_id)
-        response_body = list(map(lambda x: x.serialize(), getlikedlist))
 
-        return jsonify(response_body), 200
+        return collection_response(user_id, 'tags_liked', getlikedlist)
 
     return "Ok!", 200
 
@@ -323,11 +576,13 @@ def postget_taglike(user_id):
 @app.route('/user/<int:user_id>/detl/<int:id>', methods=['DELETE'])
 def remove_taglikes(user_id, id):
 
-    removetag = TagLike.query.get(id)
+    removetag = delete_owned(TagLike, id, user_id)
     if removetag is None:
         raise APIException('ID not found', status_code=404)
-    db.session.delete(removetag)
+    Tombstone.record(user_id, 'tags_liked', id)
+    PreferenceSet.sync(user_id, 'tags_liked', [removetag['external_id']])
     db.session.commit()
+    user_cache.invalidate(user_id, 'tags_liked')
 
     return jsonify('Deletion successful'), 200
 
@@ -335,35 +590,177 @@ def remove_taglikes(user_id, id):
 @app.route('/user/<int:user_id>/tagdislike', methods=['POST', 'GET'])
 def postget_tagdislikes(user_id):
 
-    body = request.get_json()
-
     if request.method == 'POST':
+        body = request.get_json()
         addislike = TagDislike(user_id=user_id, tag_name=body['tag_name'], tag_id=body['tag_id'])
-        db.session.add(addislike)
+        addislike.version = bump_user_version(user_id)
+        upsert_one(addislike)
+        PreferenceSet.sync(user_id, 'tags_disliked', [addislike.tag_id])
         db.session.commit()
+        user_cache.invalidate(user_id, 'tags_disliked')
         response_body = addislike.serialize()
 
         return jsonify(response_body), 200
 
     if request.method == 'GET':
         getdislikedlist = TagDislike.query.filter_by(user_id=user_id)
-        response_body = list(map(lambda x: x.serialize(), getdislikedlist))
 
-        return jsonify(response_body), 200
+        return collection_response(user_id, 'tags_disliked', getdislikedlist)
 
     return "Ok!", 200
 
 # TagDislike DELETE (Remove)
 @app.route('/user/<int:user_id>/detd/<int:id>', methods=['DELETE'])
 def remove_tagdislikes(user_id, id):
-    removetag = TagDislike.query.get(id)
+    removetag = delete_owned(TagDislike, id, user_id)
     if removetag is None:
         raise APIException('ID not found', status_code=404)
-    db.session.delete(removetag)
+    Tombstone.record(user_id, 'tags_disliked', id)
+    PreferenceSet.sync(user_id, 'tags_disliked', [removetag['external_id']])
     db.session.commit()
+    user_cache.invalidate(user_id, 'tags_disliked')
 
     return jsonify('Deletion successful'), 200
 
+# Collections that accept bulk writes: URL segment -> (collection, fields a new item needs)
+BULK_COLLECTIONS = {
+    'backlog': ('user_games', ('game_name', 'game_id', 'game_image', 'game_status')),
+    'genrelikes': ('genres_liked', ('genre_name', 'genre_id')),
+    'genredislikes': ('genres_disliked', ('genre_name', 'genre_id')),
+    'taglike': ('tags_liked', ('tag_name', 'tag_id')),
+    'tagdislike': ('tags_disliked', ('tag_name', 'tag_id')),
+}
+BULK_LIMIT = 5000
+
+def bulk_body(key=None):
+    body = request.get_json()
+    items = body.get(key) if key is not None and isinstance(body, dict) else body
+    if not isinstance(items, list):
+        raise APIException('Expected a list of %s.' % ('items' if key is None else key), status_code=400)
+    if len(items) > BULK_LIMIT:
+        raise APIException('At most %d items per request.' % BULK_LIMIT, status_code=400)
+    return body, items
+
+def bulk_ids(key='ids'):
+    body, ids = bulk_body(key)
+    if not all(isinstance(x, int) and not isinstance(x, bool) for x in ids):
+        raise APIException('ids must be integers.', status_code=400)
+    return body, ids
+
+# Bulk POST (Add many) / PUT (Update many, backlog only) / DELETE (Remove many)
+# Everything is written in one transaction and every item gets its own result, in
+# the order it was sent.
+@app.route('/user/<int:user_id>/<any(backlog, genrelikes, genredislikes, taglike, tagdislike):collection>/bulk', methods=['POST', 'PUT', 'DELETE'])
+def bulk_collection(user_id, collection):
+
+    name, required = BULK_COLLECTIONS[collection]
+    model = User.child_model(name)
+    if request.method == 'PUT' and model is not Backlog:
+        raise APIException('Only the backlog supports bulk updates.', status_code=405)
+    if User.query.get(user_id) is None:
+        raise APIException('Username does not exist.', status_code=404)
+
+    if request.method == 'POST':
+        body, items = bulk_body()
+        results = []
+        rows = []
+        version = None
+        for item in items:
+            missing = [name for name in required if not isinstance(item, dict) or name not in item]
+            if missing:
+                results.append({"status": 400, "error": "Missing %s" % ", ".join(missing)})
+                continue
+            if version is None:
+                version = bump_user_version(user_id)
+            # The client's fields are echoed back; the server's columns go on a copy
+            results.append({"status": 201, "item": {name: item[name] for name in required}})
+            row = {name: item[name] for name in required}
+            row['user_id'] = user_id
+            row['version'] = version
+            rows.append(row)
+        # One executemany INSERT (an upsert where the model has a unique key) for the
+        # whole batch. Asking for the generated ids back would force most drivers into
+        # one INSERT per row, so items are echoed without them; GET the collection to
+        # see the new ids.
+        if rows:
+            if issubclass(model, Preference):
+                upsert(model, [model.insert_row(row) for row in rows])
+            elif model is Backlog:
+                Game.remember([{key: row[key] for key in Game.__table__.c.keys()} for row in rows])
+                db.session.execute(model.__table__.insert(), [{key: row[key] for key in row if key in model.__table__.c} for row in rows])
+            else:
+                db.session.execute(model.__table__.insert(), rows)
+            if name in PreferenceSet.sources:
+                PreferenceSet.sync(user_id, name, [row[PreferenceSet.sources[name][1]] for row in rows])
+        db.session.commit()
+        user_cache.invalidate(user_id, name)
+
+        return jsonify(results), 200
+
+    body, ids = bulk_ids()
+    owned = model.query.filter(model.user_id == user_id, model.id.in_(ids))
+    found = set(id for (id,) in owned.with_entities(model.id))
+
+    if request.method == 'PUT':
+        changes = {name: body[name] for name in required if name in body}
+        if not changes:
+            raise APIException('Nothing to update.', status_code=400)
+        if "game_id" in changes and changes["game_id"] is None:
+            raise APIException('game_id cannot be null.', status_code=400)
+        check_catalog_fields(changes)
+        game = dict((key, changes.pop(key, None)) for key in Game.__table__.c.keys())
+        if found and game['game_id'] is not None:
+            changes['game_id'] = game['game_id']
+            Game.remember([game])
+        if found and changes:
+            changes['version'] = bump_user_version(user_id)
+            owned.update(changes, synchronize_session=False)
+    else:
+        if found:
+            version = bump_user_version(user_id)
+            if name in PreferenceSet.sources:
+                values = [value for (value,) in owned.with_entities(getattr(model, PreferenceSet.sources[name][1]))]
+            owned.delete(synchronize_session=False)
+            db.session.execute(Tombstone.__table__.insert(), [{"user_id": user_id, "collection": name, "row_id": id, "version": version} for id in found])
+            if name in PreferenceSet.sources:
+                PreferenceSet.sync(user_id, name, values)
+    db.session.commit()
+    user_cache.invalidate(user_id, name)
+
+    results = [{"id": id, "status": 200 if id in found else 404} for id in ids]
+    return jsonify(results), 200
+
+RECOMMEND_LIMIT = 10000
+
+# Rank a batch of candidate games against the user's genre and tag likes/dislikes:
+#   {"games": [{"game_id": 3498, "genres": [4, 51], "tags": [31, 7]}, ...], "limit": 20}
+# Games already in the user's backlog are left out.
+@app.route('/user/<int:user_id>/recommendations', methods=['POST'])
+def recommend_games(user_id):
+
+    body = request.get_json()
+    games = body.get('games') if isinstance(body, dict) else None
+    if not isinstance(games, list) or not all(isinstance(game, dict) for game in games):
+        raise APIException('Expected {"games": [{"game_id", "genres", "tags"}, ...]}.', status_code=400)
+    if len(games) > RECOMMEND_LIMIT:
+        raise APIException('At most %d games per request.' % RECOMMEND_LIMIT, status_code=400)
+    limit = body.get('limit', 20)
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        raise APIException('limit must be a positive integer.', status_code=400)
+    if User.query.get(user_id) is None:
+        raise APIException('Username does not exist.', status_code=404)
+
+    taste = PreferenceSet.for_user(user_id)
+    pref_keys, pref_weights = preference_vector(*[unpack(getattr(taste, name)) for name in PreferenceSet.sources])
+    backlog = [id for (id,) in db.session.query(Backlog.game_id).filter_by(user_id=user_id)]
+    try:
+        ranked = rank(games, pref_keys, pref_weights, exclude=backlog, limit=limit)
+    except ValueError as error:
+        raise APIException(str(error), status_code=400)
+    response_body = [{"game_id": games[index].get('game_id'), "score": score} for index, score in ranked]
+
+    return jsonify(response_body), 200
+
 # this only runs if `$ python src/main.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
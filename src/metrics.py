@@ -0,0 +1,199 @@
+"""
+Per-endpoint request metrics, served in the Prometheus text format by GET /metrics.
+
+`setup_metrics(app)` times every request and, through SQLAlchemy cursor events, counts
+the SQL statements it runs and the time they take. Requests are grouped by their URL
+rule, so /user/1/backlog and /user/2/backlog are one series:
+
+    hexbreak_requests_total                    by method, endpoint and status
+    hexbreak_request_duration_seconds          histogram by method and endpoint
+    hexbreak_request_sql_statements            histogram by method and endpoint
+    hexbreak_request_db_seconds                histogram by method and endpoint
+    hexbreak_response_bytes                    histogram by method and endpoint, as sent
+                                               (after compression)
+
+and, for the connection pool of database.py (not used with SQLite):
+
+    hexbreak_db_pool_wait_seconds              histogram of the wait for a connection
+    hexbreak_db_pool_timeouts_total            waits that gave up
+    hexbreak_db_pool_connections               connections by state: in_use, idle, overflow
+
+A streamed response is recorded once it has been sent, so the queries it runs while
+streaming are counted too. Every gunicorn worker keeps its own numbers.
+
+    METRICS_SLOW_MS=0      log requests slower than this, with their SQL (0 for off)
+"""
+import os
+import time
+import threading
+import weakref
+from bisect import bisect_left
+from flask import g, has_app_context, request, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0)
+
+# Statements kept per request for the slow log
+MAX_LOGGED_STATEMENTS = 50
+
+class RequestStats:
+    def __init__(self, capture=False):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.size = 0
+        self.captured = [] if capture else None
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # labels -> [count per bucket..., +Inf count, sum]
+        self.series = {}
+
+    def observe(self, labels, value):
+        counts = self.series.get(labels)
+        if counts is None:
+            counts = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self, names):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        for labels, counts in sorted(self.series.items()):
+            label = _labels(names, labels)
+            total = 0
+            for bucket, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                lines.append('%s_bucket{%s} %d' % (self.name, ','.join(filter(None, (label, 'le="%s"' % bucket))), total))
+            lines.append('%s_sum%s %r' % (self.name, '{%s}' % label if label else '', float(counts[-1])))
+            lines.append('%s_count%s %d' % (self.name, '{%s}' % label if label else '', total))
+        return lines
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values):
+    return ','.join('%s="%s"' % (name, _escape(value)) for name, value in zip(names, values))
+
+class Metrics:
+    def __init__(self, slow_ms=0):
+        self.slow_ms = slow_ms
+        self.logger = None
+        self.requests = {}
+        self.duration = Histogram('hexbreak_request_duration_seconds', 'Time to handle and send the response.', DURATION_BUCKETS)
+        self.sql_statements = Histogram('hexbreak_request_sql_statements', 'SQL statements run per request.', STATEMENT_BUCKETS)
+        self.db_time = Histogram('hexbreak_request_db_seconds', 'Time spent in SQL statements per request.', DURATION_BUCKETS)
+        self.response_size = Histogram('hexbreak_response_bytes', 'Response body size as sent.', SIZE_BUCKETS)
+        self.pool_wait = Histogram('hexbreak_db_pool_wait_seconds', 'Time to get a connection from the pool.', POOL_WAIT_BUCKETS)
+        self.pool_timeouts = 0
+        self.pools = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        g._metrics = RequestStats(capture=self.slow_ms > 0)
+
+    def after_request(self, response):
+        stats = g.get('_metrics')
+        if stats is None:
+            return response
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        method = request.method
+        path = request.full_path.rstrip('?')
+        if response.is_streamed and not response.direct_passthrough:
+            response.response = self._count(response.response, stats)
+        else:
+            stats.size = response.content_length or 0
+        # Recorded once the server is done sending, so a streamed body is included
+        response.call_on_close(lambda: self.record(method, endpoint, path, response.status_code, stats))
+        return response
+
+    def _count(self, chunks, stats):
+        for chunk in chunks:
+            stats.size += len(chunk)
+            yield chunk
+
+    # The start time rides on the statement's execution context, so a statement that
+    # fails (and never reaches after_cursor_execute) leaves nothing behind on the
+    # pooled connection
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_start = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, '_metrics_start', None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        stats = g.get('_metrics') if has_app_context() else None
+        if stats is None:
+            return
+        stats.statements += 1
+        stats.db_time += elapsed
+        if stats.captured is not None and len(stats.captured) < MAX_LOGGED_STATEMENTS:
+            stats.captured.append((elapsed, statement))
+
+    def record(self, method, endpoint, path, status, stats):
+        elapsed = time.perf_counter() - stats.start
+        labels = (method, endpoint)
+        with self._lock:
+            key = labels + (status,)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.duration.observe(labels, elapsed)
+            self.sql_statements.observe(labels, stats.statements)
+            self.db_time.observe(labels, stats.db_time)
+            self.response_size.observe(labels, stats.size)
+
+        if self.slow_ms and elapsed * 1000 >= self.slow_ms and self.logger is not None:
+            lines = ['Slow request %s %s: %d %.1f ms, %d SQL statements in %.1f ms, %d bytes' % (
+                method, path, status, elapsed * 1000, stats.statements, stats.db_time * 1000, stats.size)]
+            lines += ['  %7.1f ms  %s' % (seconds * 1000, ' '.join(statement.split())) for seconds, statement in stats.captured]
+            if stats.statements > len(stats.captured):
+                lines.append('  ... %d more' % (stats.statements - len(stats.captured)))
+            self.logger.warning('\n'.join(lines))
+
+    def observe_checkout(self, seconds):
+        with self._lock:
+            self.pool_wait.observe((), seconds)
+
+    def render(self):
+        with self._lock:
+            lines = ['# HELP hexbreak_requests_total Requests handled.', '# TYPE hexbreak_requests_total counter']
+            for labels, count in sorted(self.requests.items()):
+                lines.append('hexbreak_requests_total{%s} %d' % (_labels(('method', 'endpoint', 'status'), labels), count))
+            for histogram in (self.duration, self.sql_statements, self.db_time, self.response_size):
+                lines += histogram.render(('method', 'endpoint'))
+            if self.pools:
+                lines += self.pool_wait.render(())
+                lines += ['# HELP hexbreak_db_pool_timeouts_total Checkouts that timed out waiting for a connection.',
+                          '# TYPE hexbreak_db_pool_timeouts_total counter',
+                          'hexbreak_db_pool_timeouts_total %d' % self.pool_timeouts]
+                lines += ['# HELP hexbreak_db_pool_connections Connections of the pool, by state.', '# TYPE hexbreak_db_pool_connections gauge']
+                in_use = sum(pool.checkedout() for pool in self.pools)
+                idle = sum(pool.checkedin() for pool in self.pools)
+                overflow = sum(max(pool.overflow(), 0) for pool in self.pools)
+                for state, value in (('in_use', in_use), ('idle', idle), ('overflow', overflow)):
+                    lines.append('hexbreak_db_pool_connections{state="%s"} %d' % (state, value))
+        return '\n'.join(lines) + '\n'
+
+    def response(self):
+        return Response(self.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+metrics = Metrics()
+
+def setup_metrics(app):
+    metrics.slow_ms = float(os.environ.get('METRICS_SLOW_MS', 0))
+    metrics.logger = app.logger
+    if not event.contains(Engine, 'before_cursor_execute', metrics.before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', metrics.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', metrics.after_cursor_execute)
+    app.before_request(metrics.before_request)
+    # after_request hooks run in reverse order of registration: set up before
+    # compression so the size recorded is the one sent
+    app.after_request(metrics.after_request)
+    app.extensions['metrics'] = metrics
@@ -1,12 +1,75 @@
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, and_, column, event, func, literal, literal_column, or_, select, table
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session, selectinload, synonym, with_loader_criteria
+import preferences
+from catalog import game_catalog, NO_GAME
+from replicas import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+# GET requests read from the replicas when there are any, see replicas.py
+db = RoutingSQLAlchemy()
+
+# Whether UPDATE or DELETE ('update' / 'delete') ... RETURNING works on this database:
+# Postgres, SQLite 3.35+ (with SQLAlchemy 2) and MariaDB for deletes; not MySQL.
+def supports_returning(statement):
+    dialect = db.engine.dialect
+    return getattr(dialect, statement + '_returning', getattr(dialect, 'full_returning', False))
+
+# UPDATE (with `values`) or DELETE of row `id` of `model`, only if `user_id` owns it,
+# as one statement that returns the row where RETURNING is supported and as a SELECT
+# plus the write elsewhere. Returns the row's columns after the write as a dict, or
+# None when the user has no such row.
+def write_owned(model, id, user_id, values=None):
+    table = model.__table__
+    where = [table.c.id == id, table.c.user_id == user_id]
+    mapper = model.__mapper__
+    if mapper.polymorphic_identity is not None:
+        where.extend(model.discriminator())
+    statement = table.delete() if values is None else table.update().values(values)
+    statement = statement.where(*where)
+
+    if supports_returning('delete' if values is None else 'update'):
+        row = db.session.execute(statement.returning(*table.c)).first()
+        return dict(row._mapping) if row is not None else None
+    row = db.session.execute(table.select().where(*where)).first()
+    if row is None:
+        return None
+    db.session.execute(statement)
+    return dict(row._mapping, **(values or {}))
+
+def update_owned(model, id, user_id, values):
+    return write_owned(model, id, user_id, values)
+
+def delete_owned(model, id, user_id):
+    return write_owned(model, id, user_id)
+
+# The fast read path for lists: the dicts serialize() would return, built straight
+# from plain column tuples so no ORM objects are loaded. `json_fields` pairs each key
+# of serialize() with the attribute it comes from.
+class JSONRows:
+    json_fields = ()
+
+    @classmethod
+    def json_columns(cls):
+        return [getattr(cls, attribute) for key, attribute in cls.json_fields]
+
+    # Trailing columns beyond json_fields (e.g. a sort key) are ignored
+    @classmethod
+    def json_rows(cls, rows):
+        keys = [key for key, attribute in cls.json_fields]
+        return [dict(zip(keys, row)) for row in rows]
+
+    @classmethod
+    def json_query(cls, query):
+        return query.with_entities(*cls.json_columns())
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     username = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(80), unique=False, nullable=False)
+    # A hash from passwords.py, or a plain password stored before hashing (see /login)
+    password = db.Column(db.String(255), unique=False, nullable=False)
+    # Bumped by every write to any of the user's collections; the basis of their ETags
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     user_games = db.relationship('Backlog', backref='user', lazy=True)
     user_platforms = db.relationship('Platform', backref='user', lazy=True)
     genres_liked = db.relationship('GenreLike', backref='user', lazy=True)
@@ -14,27 +77,124 @@ class User(db.Model):
     tags_liked = db.relationship('TagLike', backref='user', lazy=True)
     tags_disliked = db.relationship('TagDislike', backref='user', lazy=True)
 
+    # Plain columns and child collections, in the order they are serialized
+    fields = ('id', 'email', 'username')
+    collections = ('user_games', 'user_platforms', 'genres_liked', 'genres_disliked', 'tags_liked', 'tags_disliked')
+
     def __repr__(self):
         return '<User %r>' % self.id
 
-    def serialize(self):
-        return {
-            "id": self.id,
-            "email": self.email,
-            "username": self.username,
-            "user_games": list(map(lambda x: x.serialize(), self.user_games)),
-            "user_platforms": list(map(lambda x: x.serialize(), self.user_platforms)),
-            "genres_liked": list(map(lambda x: x.serialize(), self.genres_liked)),
-            "genres_disliked": list(map(lambda x: x.serialize(), self.genres_disliked)),
-            "tags_liked": list(map(lambda x: x.serialize(), self.tags_liked)),
-            "tags_disliked": list(map(lambda x: x.serialize(), self.tags_disliked))
-        }
+    # Query options that load the given collections (all of them by default) with one
+    # batched "WHERE user_id IN (...)" query per collection instead of one per user.
+    @classmethod
+    def eager(cls, collections=None):
+        if collections is None:
+            collections = cls.collections
+        return [selectinload(getattr(cls, name)) for name in collections]
+
+    # Must run inside the transaction that writes the collection, so the new version
+    # and the new rows become visible together. Returns the new version, which the
+    # written rows (or their tombstones) are stamped with.
+    @classmethod
+    def bump_version(cls, user_id):
+        table = cls.__table__
+        bump = table.update().where(table.c.id == user_id).values(version=table.c.version + 1)
+        if supports_returning('update'):
+            return db.session.execute(bump.returning(table.c.version)).scalar()
+        db.session.execute(bump)
+        return db.session.query(cls.version).filter_by(id=user_id).scalar()
+
+    # The model class behind one of the collections
+    @classmethod
+    def child_model(cls, collection):
+        return getattr(cls, collection).property.mapper.class_
+
+    # Only the keys named in `fields` are serialized (everything by default), so a
+    # collection that isn't asked for is never touched and never loaded.
+    def serialize(self, fields=None):
+        if fields is None:
+            fields = self.fields + self.collections
+        result = {}
+        for name in fields:
+            value = getattr(self, name)
+            if name in self.collections:
+                value = list(map(lambda x: x.serialize(), value))
+            result[name] = value
+        return result
+
+# INSERT ... ON CONFLICT DO UPDATE on the model's unique_key: a row that already exists
+# gets its other columns overwritten instead of a duplicate, so a retried POST costs
+# one statement and leaves the table as it was. With update=False an existing row is
+# kept as it is (DO NOTHING), and with fill=True it only takes the new values of its
+# columns that are NULL (COALESCE). `rows` are table column dicts; more than one are
+# sent as a single executemany.
+def upsert(model, rows, update=True, fill=False):
+    table = model.__table__
+    keys = model.unique_key
+    # Postgres refuses to update the same row twice in one statement: last one wins.
+    # Keys with a NULL never conflict, so those rows are all kept.
+    unique = {}
+    for n, row in enumerate(rows):
+        key = tuple(row[name] for name in keys)
+        unique[n if None in key else key] = row
+    rows = list(unique.values())
+    columns = [name for name in rows[0] if name not in keys] if update or fill else []
+
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+        if columns:
+            statement = insert.on_conflict_do_update(index_elements=list(keys), set_=dict((name, func.coalesce(table.c[name], insert.excluded[name]) if fill else insert.excluded[name]) for name in columns))
+        else:
+            statement = insert.on_conflict_do_nothing(index_elements=list(keys))
+    elif dialect in ('mysql', 'mariadb'):
+        insert = mysql.insert(table)
+        updates = dict((name, func.coalesce(table.c[name], insert.inserted[name]) if fill else insert.inserted[name]) for name in columns)
+        if 'id' in table.c:
+            # Makes the driver's lastrowid the id of the existing row when there is one
+            updates['id'] = func.last_insert_id(table.c.id)
+        if not updates:
+            updates[keys[0]] = table.c[keys[0]]
+        statement = insert.on_duplicate_key_update(updates)
+    else:
+        raise NotImplementedError('upsert() does not support %s' % dialect)
+    if len(rows) > 1:
+        return db.session.execute(statement, rows)
+    if dialect == 'postgresql' and 'id' in table.c:
+        statement = statement.returning(table.c.id)
+    return db.session.execute(statement, rows[0])
+
+# upsert() of a single new, unsaved object; sets its id to the inserted or existing row's
+def upsert_one(obj):
+    model = type(obj)
+    row = dict((column.key, getattr(obj, column.key)) for column in model.__table__.columns if not column.primary_key)
+    result = upsert(model, [row])
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        obj.id = result.scalar()
+    elif dialect == 'sqlite' and None not in (row[name] for name in model.unique_key):
+        # SQLite's lastrowid is stale when the row already existed
+        table = model.__table__
+        obj.id = db.session.query(table.c.id).filter(*[table.c[name] == row[name] for name in model.unique_key]).scalar()
+    else:
+        obj.id = result.lastrowid
+    return obj
 
-class Platform(db.Model):
+class Platform(JSONRows, db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     platform_name = db.Column(db.String(120), unique=False, nullable=True)
     platform_id = db.Column(db.String(120), unique=False, nullable=True)
+    # The user's version at this row's last write, see /user/<id>/changes
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        db.Index('ix_platform_user_id_version', 'user_id', 'version'),
+        db.Index('uq_platform_user_id_platform_id', 'user_id', 'platform_id', unique=True),
+    )
+    # What makes a row a duplicate, see upsert()
+    unique_key = ('user_id', 'platform_id')
+    json_fields = (('id', 'id'), ('user_id', 'user_id'), ('platform_name', 'platform_name'), ('platform_id', 'platform_id'))
 
     def __repr__(self):
         return '<Platform %r>' % self.id
@@ -47,35 +207,204 @@ class Platform(db.Model):
             "platform_id": self.platform_id
         }
 
-class Backlog(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+# One row per game, shared by every backlog that has it. Served from the in-process
+# catalog cache (catalog.py) when backlogs are serialized.
+class Game(db.Model):
+    game_id = db.Column(db.String(120), primary_key=True)
     game_name = db.Column(db.String(250), unique=False, nullable=True)
-    game_id = db.Column(db.String(120), unique=False, nullable=True)
     game_image = db.Column(db.String(120), unique=False, nullable=True)
+
+    __table_args__ = (
+        # A trigram index on Postgres (ILIKE '%...%' and prefixes), a plain btree
+        # (prefixes) elsewhere. SQLite searches through game_fts instead, see below.
+        db.Index('ix_game_game_name', 'game_name', postgresql_using='gin', postgresql_ops={'game_name': 'gin_trgm_ops'}),
+    )
+    unique_key = ('game_id',)
+
+    def __repr__(self):
+        return '<Game %r>' % self.game_id
+
+    # Adds the game to the catalog unless it's already there: the name and image come
+    # from the same games API for every user, so the first writer's copy is kept. Only
+    # a name or image the entry lacks is taken from a later copy that has one.
+    @classmethod
+    def remember(cls, games):
+        rows = [game for game in games if game.get('game_id') is not None]
+        if not rows:
+            return
+        offered = dict((row['game_id'], row) for row in rows if row.get('game_name') is not None or row.get('game_image') is not None)
+        filled = []
+        if offered:
+            incomplete = db.session.query(cls.game_id, cls.game_name, cls.game_image).filter(cls.game_id.in_(offered), or_(cls.game_name.is_(None), cls.game_image.is_(None)))
+            for game_id, game_name, game_image in incomplete:
+                row = offered[game_id]
+                if (game_name is None and row.get('game_name') is not None) or (game_image is None and row.get('game_image') is not None):
+                    filled.append(game_id)
+        upsert(cls, rows, update=False, fill=bool(filled))
+        if filled:
+            cls.changed(filled)
+
+    # After the catalog entries of `game_ids` changed: every backlog row with one of
+    # them is stamped with its owner's next version, so cached and ETagged backlogs
+    # are rebuilt and delta sync sends the rows again. Call it inside the transaction
+    # that changes the entries.
+    @classmethod
+    def changed(cls, game_ids):
+        users = User.__table__
+        backlog = Backlog.__table__
+        owners = select(backlog.c.user_id).where(backlog.c.game_id.in_(game_ids))
+        db.session.execute(users.update().where(users.c.id.in_(owners)).values(version=users.c.version + 1))
+        version = select(users.c.version).where(users.c.id == backlog.c.user_id).scalar_subquery()
+        db.session.execute(backlog.update().where(backlog.c.game_id.in_(game_ids)).values(version=version))
+
+    # Condition for games whose name contains `text` (or starts with it, with
+    # prefix=True), case-insensitively, in the form each database can answer from an
+    # index: ILIKE on the trigram index on Postgres, an FTS5 trigram MATCH on SQLite
+    # (for 3 characters or more) and LIKE elsewhere.
+    @classmethod
+    def name_matches(cls, text, prefix=False):
+        pattern = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        if not prefix:
+            pattern = '%' + pattern
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            return cls.game_name.ilike(pattern, escape='\\')
+        condition = cls.game_name.like(pattern, escape='\\')
+        if dialect == 'sqlite' and len(text) >= 3:
+            # The trigram MATCH finds the substring, LIKE keeps it to prefixes if asked
+            phrase = '"%s"' % text.replace('"', '""')
+            matches = select(game_fts.c.rowid).where(game_fts.c.game_name.op('MATCH')(phrase))
+            return and_(literal_column('game.rowid').in_(matches), condition)
+        return condition
+
+    def serialize(self):
+        return {
+            "game_id": self.game_id,
+            "game_name": self.game_name,
+            "game_image": self.game_image
+        }
+
+# Full-text index of the game names on SQLite, an external-content FTS5 table kept in
+# step with `game` by triggers. Created with the table; migrations/env.py leaves it
+# out of autogenerate.
+game_fts = table('game_fts', column('rowid'), column('game_name'))
+
+GAME_FTS_DDL = (
+    "CREATE VIRTUAL TABLE game_fts USING fts5(game_name, content='game', tokenize='trigram')",
+    "CREATE TRIGGER game_fts_insert AFTER INSERT ON game BEGIN "
+    "INSERT INTO game_fts(rowid, game_name) VALUES (new.rowid, new.game_name); END",
+    "CREATE TRIGGER game_fts_delete AFTER DELETE ON game BEGIN "
+    "INSERT INTO game_fts(game_fts, rowid, game_name) VALUES ('delete', old.rowid, old.game_name); END",
+    "CREATE TRIGGER game_fts_update AFTER UPDATE ON game BEGIN "
+    "INSERT INTO game_fts(game_fts, rowid, game_name) VALUES ('delete', old.rowid, old.game_name); "
+    "INSERT INTO game_fts(rowid, game_name) VALUES (new.rowid, new.game_name); END",
+)
+
+for statement in GAME_FTS_DDL:
+    event.listen(Game.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Game.__table__, 'after_drop', DDL('DROP TABLE IF EXISTS game_fts').execute_if(dialect='sqlite'))
+event.listen(Game.__table__, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+# For Migrate(include_object=...): the FTS5 table and its shadow tables aren't models
+def include_object(object, name, type_, reflected, compare_to):
+    return not (type_ == 'table' and name.startswith('game_fts'))
+
+class Backlog(JSONRows, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    game_id = db.Column(db.String(120), db.ForeignKey('game.game_id'), unique=False, nullable=True)
     game_status = db.Column(db.String(30), unique=False, nullable=True)
+    # The user's version at this row's last write, see /user/<id>/changes
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        db.Index('ix_backlog_user_id_game_status', 'user_id', 'game_status'),
+        # Finds the owners of a game whose catalog entry changed, see Game.changed
+        db.Index('ix_backlog_game_id', 'game_id'),
+        db.Index('ix_backlog_user_id_version', 'user_id', 'version'),
+    )
+    json_fields = (('id', 'id'), ('user_id', 'user_id'), ('game_id', 'game_id'), ('game_status', 'game_status'))
 
     def __repr__(self):
         return '<Backlog %r>' % self.id
 
     def serialize(self):
+        game = game_catalog.get(self.game_id)
         return {
             "id": self.id,
             "user_id": self.user_id,
-            "game_name": self.game_name,
+            "game_name": game["game_name"],
             "game_id": self.game_id,
-            "game_image": self.game_image,
+            "game_image": game["game_image"],
             "game_status": self.game_status
         }
 
-class GenreLike(db.Model):
+    @classmethod
+    def json_rows(cls, rows):
+        items = super().json_rows(rows)
+        games = game_catalog.get_many(item['game_id'] for item in items)
+        for item in items:
+            item.update(games.get(item['game_id'], NO_GAME))
+        return items
+
+# Every loaded row queues its game for the catalog's next batched fetch
+@event.listens_for(Backlog, 'load')
+def want_game(target, context):
+    game_catalog.want(target.game_id)
+
+# Genre and tag likes and dislikes all live in this one table, one row per
+# (user, kind, polarity, external id), so a user's whole taste profile is a single
+# range scan of ix_preference_profile. GenreLike, GenreDislike, TagLike and TagDislike
+# are single-table-inheritance views of it that keep their old attribute names.
+class Preference(JSONRows, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    genre_name = db.Column(db.String(50), unique=False, nullable=True)
-    genre_id = db.Column(db.String(50), unique=False, nullable=True)
+    kind = db.Column(db.String(10), nullable=False)
+    polarity = db.Column(db.String(10), nullable=False)
+    external_id = db.Column(db.String(50), unique=False, nullable=True)
+    name = db.Column(db.String(50), unique=False, nullable=True)
+    # The user's version at this row's last write, see /user/<id>/changes
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        # Covers the serialized columns too: SQLite and InnoDB keep the primary key in
+        # every index entry, Postgres gets it as an INCLUDE column.
+        db.Index('ix_preference_profile', 'user_id', 'kind', 'polarity', 'external_id', 'name', postgresql_include=['id']),
+        db.Index('ix_preference_user_id_version', 'user_id', 'version'),
+        db.Index('uq_preference_user_id_kind_polarity_external_id', 'user_id', 'kind', 'polarity', 'external_id', unique=True),
+    )
+    # What makes a row a duplicate, see upsert()
+    unique_key = ('user_id', 'kind', 'polarity', 'external_id')
+    __mapper_args__ = {
+        'polymorphic_on': kind + '_' + polarity,
+    }
+
+    def __init__(self, **kwargs):
+        super().__init__(kind=self.pref_kind, polarity=self.pref_polarity, **kwargs)
 
     def __repr__(self):
-        return '<GenreLike %r>' % self.id
+        return '<%s %r>' % (type(self).__name__, self.id)
+
+    # The subclass's rows, as plain column comparisons ix_preference_profile can seek on
+    @classmethod
+    def discriminator(cls):
+        return [cls.__table__.c.kind == cls.pref_kind, cls.__table__.c.polarity == cls.pref_polarity]
+
+    # Table row for a Core (executemany) insert, from the subclass's attribute names
+    @classmethod
+    def insert_row(cls, values):
+        row = dict((key, value) for key, value in values.items() if key not in (cls.id_field, cls.name_field))
+        row.update(kind=cls.pref_kind, polarity=cls.pref_polarity, external_id=values.get(cls.id_field), name=values.get(cls.name_field))
+        return row
+
+class GenreLike(Preference):
+    pref_kind, pref_polarity = 'genre', 'like'
+    id_field, name_field = 'genre_id', 'genre_name'
+    genre_id = synonym('external_id')
+    genre_name = synonym('name')
+
+    __mapper_args__ = {'polymorphic_identity': 'genre_like'}
+    json_fields = (('id', 'id'), ('user_id', 'user_id'), ('genre_id', 'external_id'), ('genre_name', 'name'))
 
     def serialize(self):
         return {
@@ -85,14 +414,14 @@ class GenreLike(db.Model):
             "genre_id": self.genre_id
         }
 
-class GenreDislike(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    genre_name = db.Column(db.String(50), unique=False, nullable=True)
-    genre_id = db.Column(db.String(50), unique=False, nullable=True)
+class GenreDislike(Preference):
+    pref_kind, pref_polarity = 'genre', 'dislike'
+    id_field, name_field = 'genre_id', 'genre_name'
+    genre_id = synonym('external_id')
+    genre_name = synonym('name')
 
-    def __repr__(self):
-        return '<GenreDislike %r>' % self.id
+    __mapper_args__ = {'polymorphic_identity': 'genre_dislike'}
+    json_fields = (('id', 'id'), ('user_id', 'user_id'), ('genre_id', 'external_id'), ('genre_name', 'name'))
 
     def serialize(self):
         return {
@@ -102,14 +431,14 @@ class GenreDislike(db.Model):
             "genre_id": self.genre_id
         }
 
-class TagLike(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    tag_name = db.Column(db.String(50), unique=False, nullable=True)
-    tag_id = db.Column(db.String(50), unique=False, nullable=True)
+class TagLike(Preference):
+    pref_kind, pref_polarity = 'tag', 'like'
+    id_field, name_field = 'tag_id', 'tag_name'
+    tag_id = synonym('external_id')
+    tag_name = synonym('name')
 
-    def __repr__(self):
-        return '<TagLike %r>' % self.id
+    __mapper_args__ = {'polymorphic_identity': 'tag_like'}
+    json_fields = (('id', 'id'), ('user_id', 'user_id'), ('tag_id', 'external_id'), ('tag_name', 'name'))
 
     def serialize(self):
         return {
@@ -119,19 +448,140 @@ class TagLike(db.Model):
             "tag_id": self.tag_id
         }
 
-class TagDislike(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    tag_name = db.Column(db.String(50), unique=False, nullable=True)
-    tag_id = db.Column(db.String(50), unique=False, nullable=True)
+class TagDislike(Preference):
+    pref_kind, pref_polarity = 'tag', 'dislike'
+    id_field, name_field = 'tag_id', 'tag_name'
+    tag_id = synonym('external_id')
+    tag_name = synonym('name')
 
-    def __repr__(self):
-        return '<TagDislike %r>' % self.id
+    __mapper_args__ = {'polymorphic_identity': 'tag_dislike'}
+    json_fields = (('id', 'id'), ('user_id', 'user_id'), ('tag_id', 'external_id'), ('tag_name', 'name'))
 
     def serialize(self):
         return {
             "id": self.id,
             "user_id": self.user_id,
             "tag_name": self.tag_name,
-            "tag_id": self.tag_id       
-        }
\ No newline at end of file
+            "tag_id": self.tag_id
+        }
+
+# The ORM narrows a subclass query with "kind || '_' || polarity IN (...)", which no
+# index can seek on, so every ORM SELECT, UPDATE and DELETE also gets the plain kind
+# and polarity comparisons: with the user_id they are one range of ix_preference_profile.
+PREFERENCE_CRITERIA = [
+    with_loader_criteria(model, and_(*model.discriminator()))
+    for model in (GenreLike, GenreDislike, TagLike, TagDislike)
+]
+
+@event.listens_for(Session, 'do_orm_execute')
+def narrow_preferences(state):
+    if state.is_select or state.is_update or state.is_delete:
+        state.statement = state.statement.options(*PREFERENCE_CRITERIA)
+
+# Left behind by every delete so /user/<id>/changes can report it
+class Tombstone(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    collection = db.Column(db.String(30), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_tombstone_user_id_version', 'user_id', 'version'),
+    )
+
+    def __repr__(self):
+        return '<Tombstone %r>' % self.id
+
+    # Bumps the user's version and leaves a tombstone for `row_id` at the new version,
+    # after the row was deleted in the same transaction. On Postgres the UPDATE ...
+    # RETURNING feeds the INSERT as one statement; elsewhere the INSERT reads the new
+    # version with a SELECT of its own instead of a round trip to fetch it first.
+    @classmethod
+    def record(cls, user_id, collection, row_id):
+        users = User.__table__
+        bump = users.update().where(users.c.id == user_id).values(version=users.c.version + 1)
+        if db.engine.dialect.name == 'postgresql':
+            bumped = bump.returning(users.c.version).cte('bumped')
+            source = select(literal(user_id), literal(collection), literal(row_id), bumped.c.version)
+        else:
+            db.session.execute(bump)
+            source = select(literal(user_id), literal(collection), literal(row_id), users.c.version).where(users.c.id == user_id)
+        db.session.execute(cls.__table__.insert().from_select(['user_id', 'collection', 'row_id', 'version'], source))
+
+# Each user's liked and disliked genre and tag ids as packed sets (see preferences.py),
+# so a whole taste profile is one primary-key read. The like/dislike handlers keep it
+# in step with the four source tables inside their own transaction, and
+# `flask rebuild-preferences` recomputes it from scratch.
+class PreferenceSet(db.Model):
+    __tablename__ = 'preference_set'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    genres_liked = db.Column(db.LargeBinary, nullable=False, default=preferences.EMPTY)
+    genres_disliked = db.Column(db.LargeBinary, nullable=False, default=preferences.EMPTY)
+    tags_liked = db.Column(db.LargeBinary, nullable=False, default=preferences.EMPTY)
+    tags_disliked = db.Column(db.LargeBinary, nullable=False, default=preferences.EMPTY)
+
+    # Collection -> the model and column its ids come from
+    sources = {
+        'genres_liked': (GenreLike, 'genre_id'),
+        'genres_disliked': (GenreDislike, 'genre_id'),
+        'tags_liked': (TagLike, 'tag_id'),
+        'tags_disliked': (TagDislike, 'tag_id'),
+    }
+
+    def __repr__(self):
+        return '<PreferenceSet %r>' % self.user_id
+
+    # Ids per collection straight from the source tables, for the given users
+    @classmethod
+    def collect(cls, user_ids):
+        found = dict((user_id, dict((name, []) for name in cls.sources)) for user_id in user_ids)
+        for name, (model, column) in cls.sources.items():
+            rows = db.session.query(model.user_id, getattr(model, column)).filter(model.user_id.in_(user_ids))
+            for user_id, value in rows:
+                found[user_id][name].append(value)
+        return found
+
+    # The user's set, computed from the source tables (and not saved) if it was never built
+    @classmethod
+    def for_user(cls, user_id):
+        row = cls.query.get(user_id)
+        if row is None:
+            ids = cls.collect([user_id])[user_id]
+            row = cls(user_id=user_id, **dict((name, preferences.pack(values)) for name, values in ids.items()))
+        return row
+
+    # Re-checks `values` against the collection's source table and adds or drops each
+    # of them from the user's set. Call it after the write, before the commit.
+    @classmethod
+    def sync(cls, user_id, collection, values):
+        model, column = cls.sources[collection]
+        column = getattr(model, column)
+        values = [str(value) for value in values]
+        row = cls.query.get(user_id)
+        if row is None:
+            db.session.add(cls.for_user(user_id))
+            return
+        present = db.session.query(column).filter(model.user_id == user_id, column.in_(values)).distinct()
+        setattr(row, collection, preferences.update(getattr(row, collection), add=[value for (value,) in present], remove=values))
+
+    # Recomputes every user's set, `batch_size` users per transaction. The user rows
+    # are locked while their batch is rebuilt, like the handlers do by bumping the
+    # user's version before they write.
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        total = 0
+        after = 0
+        while True:
+            user_ids = [id for (id,) in db.session.query(User.id).filter(User.id > after).order_by(User.id).limit(batch_size).with_for_update()]
+            if not user_ids:
+                return total
+            rows = [
+                dict(user_id=user_id, **dict((name, preferences.pack(values)) for name, values in ids.items()))
+                for user_id, ids in cls.collect(user_ids).items()
+            ]
+            cls.query.filter(cls.user_id.in_(user_ids)).delete(synchronize_session=False)
+            db.session.execute(cls.__table__.insert(), rows)
+            db.session.commit()
+            total += len(user_ids)
+            after = user_ids[-1]
@@ -0,0 +1,160 @@
+"""
+Keyset pagination and streaming for the list endpoints.
+
+A list endpoint hands its query and the column it is keyed on to `list_response`.
+Clients can then page through it with `?limit=<n>&after=<cursor>`, where the
+cursor of the next page comes back in the `X-Next-Cursor` response header, or
+ask for the rows to be streamed with `?stream=json` / `?stream=ndjson` (or an
+`Accept: application/x-ndjson` header). Without any of those parameters the
+endpoint answers exactly like before: one JSON list with every row.
+
+An endpoint can also order the list by another expression first (`sort`); the key
+then only breaks ties, and the cursor carries both values.
+"""
+import base64
+import binascii
+import itertools
+from sqlalchemy import and_, or_
+from flask import request, json, Response, stream_with_context
+from utils import APIException
+from encoding import dumps, json_response
+
+MAX_LIMIT = 1000
+# Rows fetched per round trip from the server-side cursor while streaming
+STREAM_BATCH = 500
+NDJSON = 'application/x-ndjson'
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+# The types a cursor value for `expression` may have: its column's, or either
+# scalar when the expression's type doesn't tell
+def cursor_types(expression):
+    try:
+        python_type = expression.type.python_type
+    except NotImplementedError:
+        python_type = None
+    return (python_type,) if python_type in (int, str) else (int, str)
+
+def decode_cursor(token, keys):
+    """
+    The values of the cursor `token`, one for each of the expressions in `keys`
+    and each of the type that expression compares with. Anything else is a 400.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise APIException('Invalid cursor.', status_code=400)
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise APIException('Invalid cursor.', status_code=400)
+    # type(), not isinstance(): true and false are ints too
+    if any(type(value) not in cursor_types(key) for value, key in zip(values, keys)):
+        raise APIException('Invalid cursor.', status_code=400)
+    # Past a BIGINT the drivers fail before the database sees the query
+    if any(type(value) is int and not -2**63 <= value < 2**63 for value in values):
+        raise APIException('Invalid cursor.', status_code=400)
+    return values
+
+def page_args(keys):
+    limit = request.args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise APIException('limit must be an integer.', status_code=400)
+        if limit < 1 or limit > MAX_LIMIT:
+            raise APIException('limit must be between 1 and %d.' % MAX_LIMIT, status_code=400)
+    after = request.args.get('after')
+    if after is not None:
+        after = decode_cursor(after, keys)
+    return limit, after
+
+def stream_format():
+    fmt = request.args.get('stream')
+    if fmt is None and request.accept_mimetypes.best == NDJSON:
+        fmt = 'ndjson'
+    if fmt not in (None, 'json', 'ndjson'):
+        raise APIException('stream must be "json" or "ndjson".', status_code=400)
+    return fmt
+
+def stream_rows(query, fmt, serialize_many):
+    # yield_per keeps memory flat: rows come off a server-side cursor in batches
+    # and each batch is encoded and written out before the next one is read.
+    rows = iter(query.yield_per(STREAM_BATCH))
+
+    def batches():
+        while True:
+            batch = list(itertools.islice(rows, STREAM_BATCH))
+            if not batch:
+                return
+            yield serialize_many(batch)
+
+    def generate():
+        if fmt == 'ndjson':
+            for items in batches():
+                yield ''.join(dumps(item) + '\n' for item in items)
+            return
+        yield '['
+        first = True
+        for items in batches():
+            for item in items:
+                if not first:
+                    yield ','
+                first = False
+                yield dumps(item)
+        yield ']'
+
+    mimetype = NDJSON if fmt == 'ndjson' else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+def list_response(query, key, serialize=lambda x: x.serialize(), sort=None, serialize_many=None):
+    """
+    Answer a list GET for `query`, paginated on `key`: a unique column such as
+    the primary key, so "key > cursor" picks up exactly where the last page stopped.
+    `sort` is an optional (expression, descending) to order by before the key; it
+    must not be NULL, or those rows fall out of the pages.
+
+    By default `query` returns ORM objects and `serialize` turns each one into a
+    dict. With `serialize_many` it returns plain column rows instead (the fast path,
+    see models.JSONRows) and `serialize_many` turns a list of them into dicts.
+    """
+    limit, after = page_args([key] if sort is None else [sort[0], key])
+    fmt = stream_format()
+    if sort is None:
+        if after is not None:
+            query = query.filter(key > after[0])
+        query = query.order_by(key)
+    else:
+        expression, descending = sort
+        if after is not None:
+            beyond = expression < after[0] if descending else expression > after[0]
+            query = query.filter(or_(beyond, and_(expression == after[0], key > after[1])))
+        # The sort value rides along at the end of each row, for the cursor
+        query = query.add_columns(expression).order_by(expression.desc() if descending else expression, key)
+
+    def item(row):
+        return row[0] if sort is not None and serialize_many is None else row
+
+    if serialize_many is None:
+        serialize_many = lambda rows: [serialize(item(row)) for row in rows]
+
+    if fmt is not None:
+        if limit is not None:
+            query = query.limit(limit)
+        return stream_rows(query, fmt, serialize_many)
+
+    if limit is None:
+        return json_response(serialize_many(query.all())), 200
+
+    # Fetch one extra row to know whether there is a next page at all
+    rows = query.limit(limit + 1).all()
+    response = json_response(serialize_many(rows[:limit]))
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        cursor = [getattr(item(last), key.key)]
+        if sort is not None:
+            cursor.insert(0, last[-1])
+        response.headers['X-Next-Cursor'] = encode_cursor(cursor)
+    return response, 200
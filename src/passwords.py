@@ -0,0 +1,138 @@
+"""
+Password hashing for /register and /login: scrypt from the standard library, or
+PBKDF2-SHA256 where Python's OpenSSL has no scrypt.
+
+Hashing is slow on purpose, so it runs on a small pool: a burst of logins can only keep
+PASSWORD_WORKERS cores busy, and requests waiting on it don't hold the GIL. When the
+pool and its queue are full, `hasher.hash` and `hasher.check` raise a 503 instead of
+piling up more waiting requests.
+
+Hashes are stored as "<algorithm>$<cost...>$<salt>$<hash>". Rows from before hashing
+hold the plain password: `hasher.check` still accepts them, but says they need a
+rehash, as it does for hashes made with another algorithm or a lower cost than the
+configured one. /login then stores the new hash.
+
+    PASSWORD_HASH=scrypt               scrypt or pbkdf2
+    PASSWORD_SCRYPT_N=16384            scrypt cost, a power of 2 (r=8, p=1)
+    PASSWORD_PBKDF2_ITERATIONS=600000  PBKDF2-SHA256 iterations
+    PASSWORD_WORKERS=2                 hashes computed at once per worker process
+                                       (0 hashes in the request thread)
+    PASSWORD_POOL=thread               thread or process; both hash functions release
+                                       the GIL, so threads are usually enough
+    PASSWORD_QUEUE=16                  requests allowed to wait for the pool
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from utils import APIException
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+# Module level, so a process pool can run them
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=HASH_BYTES)
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations, dklen=HASH_BYTES)
+
+def _derive(algorithm, password, salt, cost):
+    if algorithm == 'scrypt':
+        return _scrypt(password, salt, *cost)
+    return _pbkdf2(password, salt, *cost)
+
+def _parse(stored):
+    """(algorithm, cost, salt, hash) of a stored hash, or None for a plain password"""
+    parts = (stored or '').split('$')
+    try:
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            return 'scrypt', tuple(int(x) for x in parts[1:4]), base64.b64decode(parts[4]), base64.b64decode(parts[5])
+        if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            return 'pbkdf2', (int(parts[1]),), base64.b64decode(parts[2]), base64.b64decode(parts[3])
+    except ValueError:
+        pass
+    return None
+
+class PasswordHasher:
+    def __init__(self, **options):
+        self._lock = threading.Lock()
+        self._executor = None
+        self.configure(**options)
+
+    def configure(self, algorithm='scrypt', scrypt_n=16384, pbkdf2_iterations=600000, workers=2, pool='thread', queue=16):
+        if algorithm == 'scrypt' and not hasattr(hashlib, 'scrypt'):
+            algorithm = 'pbkdf2'
+        self.algorithm = algorithm
+        self.cost = (scrypt_n, 8, 1) if algorithm == 'scrypt' else (pbkdf2_iterations,)
+        self.workers = workers
+        self.pool = pool
+        self._slots = threading.BoundedSemaphore(workers + queue) if workers > 0 else None
+        self._dummy = None
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    # Started on first use, so each gunicorn worker gets its own after the fork
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                executor = ProcessPoolExecutor if self.pool == 'process' else ThreadPoolExecutor
+                self._executor = executor(max_workers=self.workers)
+            return self._executor
+
+    def run(self, algorithm, password, salt, cost):
+        if self._slots is None:
+            return _derive(algorithm, password, salt, cost)
+        if not self._slots.acquire(blocking=False):
+            raise APIException('Too many password checks at once, try again.', status_code=503)
+        try:
+            return self.executor().submit(_derive, algorithm, password, salt, cost).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        salt = os.urandom(SALT_BYTES)
+        digest = self.run(self.algorithm, password, salt, self.cost)
+        prefix = 'scrypt' if self.algorithm == 'scrypt' else 'pbkdf2_sha256'
+        return '$'.join([prefix] + [str(x) for x in self.cost] + [_b64(salt), _b64(digest)])
+
+    # (matches, needs_rehash)
+    def check(self, password, stored):
+        parsed = _parse(stored)
+        if parsed is None:
+            # Stored before passwords were hashed
+            matches = hmac.compare_digest((stored or '').encode('utf-8'), password.encode('utf-8'))
+            return matches, matches
+        algorithm, cost, salt, digest = parsed
+        matches = hmac.compare_digest(self.run(algorithm, password, salt, cost), digest)
+        return matches, matches and (algorithm != self.algorithm or cost < self.cost)
+
+    # For a username that doesn't exist: takes as long as a wrong password
+    def check_unknown(self, password):
+        if self._dummy is None:
+            self._dummy = self.hash('')
+        self.check(password, self._dummy)
+        return False, False
+
+    def stats(self):
+        return {"algorithm": self.algorithm, "cost": list(self.cost), "workers": self.workers, "pool": self.pool}
+
+hasher = PasswordHasher()
+
+def setup_passwords(app):
+    hasher.configure(
+        algorithm=os.environ.get('PASSWORD_HASH', 'scrypt'),
+        scrypt_n=int(os.environ.get('PASSWORD_SCRYPT_N', 16384)),
+        pbkdf2_iterations=int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 600000)),
+        workers=int(os.environ.get('PASSWORD_WORKERS', 2)),
+        pool=os.environ.get('PASSWORD_POOL', 'thread'),
+        queue=int(os.environ.get('PASSWORD_QUEUE', 16)),
+    )
+    app.extensions['password_hasher'] = hasher
@@ -0,0 +1,37 @@
+"""
+Packed id sets: a sorted, de-duplicated array of unsigned 32-bit ids stored as bytes.
+
+They back `PreferenceSet`, which keeps each user's liked and disliked genre and tag
+ids in one row, so a whole taste profile (e.g. for the recommendations) is read
+without touching the preference table.
+"""
+import numpy as np
+
+DTYPE = np.dtype('<u4')
+EMPTY = b''
+
+def to_ids(values):
+    """The values that are valid ids, as an array; the source columns are strings"""
+    ids = []
+    for value in values:
+        try:
+            id = int(value)
+        except (TypeError, ValueError):
+            continue
+        if 0 <= id <= 0xFFFFFFFF:
+            ids.append(id)
+    return np.array(ids, dtype=DTYPE)
+
+def pack(values):
+    return np.unique(to_ids(values)).astype(DTYPE).tobytes()
+
+def unpack(blob):
+    return np.frombuffer(blob or EMPTY, dtype=DTYPE)
+
+def update(blob, add=(), remove=()):
+    ids = unpack(blob)
+    if len(remove):
+        ids = ids[~np.isin(ids, to_ids(remove))]
+    if len(add):
+        ids = np.union1d(ids, to_ids(add))
+    return ids.astype(DTYPE).tobytes()
@@ -0,0 +1,119 @@
+"""
+Ranks candidate games for a user from their genre and tag likes and dislikes.
+
+Every genre and tag id becomes one integer feature key (genres even, tags odd), so a
+user's preferences are a sparse weight vector over those keys and the candidates
+are a sparse (CSR-style) matrix of the keys each game has. Scoring is then one
+sorted lookup of every candidate feature in the preference vector plus a
+`bincount` that sums the matches per game: no Python-level loop per candidate.
+"""
+import itertools
+import numpy as np
+
+GENRE_WEIGHT = 2.0
+TAG_WEIGHT = 1.0
+
+def genre_key(genre_id):
+    return int(genre_id) * 2
+
+def tag_key(tag_id):
+    return int(tag_id) * 2 + 1
+
+def _ints(ids):
+    # Stored ids are strings; anything that isn't a number can't match a candidate
+    if isinstance(ids, np.ndarray):
+        return ids.astype(np.int64).tolist()
+    if not isinstance(ids, (list, tuple)):
+        return []
+    ints = []
+    for id in ids:
+        try:
+            ints.append(int(id))
+        except (TypeError, ValueError):
+            pass
+    return ints
+
+def _keys(ids, key):
+    return [key(id) for id in _ints(ids)]
+
+def preference_vector(genres_liked=(), genres_disliked=(), tags_liked=(), tags_disliked=()):
+    """The preferences as sorted feature keys and their weights"""
+    weights = {}
+    for ids, key, weight in ((genres_liked, genre_key, GENRE_WEIGHT), (genres_disliked, genre_key, -GENRE_WEIGHT),
+                             (tags_liked, tag_key, TAG_WEIGHT), (tags_disliked, tag_key, -TAG_WEIGHT)):
+        for k in _keys(ids, key):
+            weights[k] = weights.get(k, 0.0) + weight
+    keys = np.fromiter(sorted(weights), dtype=np.int64, count=len(weights))
+    return keys, np.array([weights[k] for k in keys.tolist()], dtype=np.float64)
+
+def _flat(lists):
+    counts = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+    rows = np.repeat(np.arange(len(lists)), counts)
+    ids = np.fromiter(itertools.chain.from_iterable(lists), dtype=np.int64, count=int(counts.sum()))
+    return rows, ids
+
+# Feature keys are the ids doubled, so ids stay within this for the keys to fit in 64 bits
+MAX_ID = 2**62
+
+def _id_list(candidate, name):
+    ids = candidate.get(name)
+    if ids is None:
+        return ()
+    if not isinstance(ids, list):
+        raise ValueError('%s must be a list of integers.' % name)
+    return ids
+
+def candidate_matrix(candidates):
+    """
+    The candidates as parallel arrays: the row (candidate index) and feature key of
+    every genre and tag they carry. Genres and tags must be lists of integers (or
+    missing); anything else raises ValueError.
+    """
+    genres = [_id_list(c, 'genres') for c in candidates]
+    tags = [_id_list(c, 'tags') for c in candidates]
+    # type(), not isinstance(): true and false are ints too
+    if not set(map(type, itertools.chain.from_iterable(genres + tags))) <= {int}:
+        raise ValueError('genres and tags must be lists of integers.')
+    try:
+        genre_rows, genre_ids = _flat(genres)
+        tag_rows, tag_ids = _flat(tags)
+    except OverflowError:
+        raise ValueError('genre and tag ids must be smaller than 2**62.')
+    # Bounds compared directly: np.abs(-2**63) overflows back to -2**63
+    if any(np.any((ids >= MAX_ID) | (ids <= -MAX_ID)) for ids in (genre_ids, tag_ids)):
+        raise ValueError('genre and tag ids must be smaller than 2**62.')
+    rows = np.concatenate((genre_rows, tag_rows))
+    keys = np.concatenate((genre_ids * 2, tag_ids * 2 + 1))
+    return rows, keys
+
+def score(candidates, pref_keys, pref_weights):
+    rows, keys = candidate_matrix(candidates)
+    scores = np.zeros(len(candidates), dtype=np.float64)
+    if len(pref_keys) == 0 or len(keys) == 0:
+        return scores
+    idx = np.searchsorted(pref_keys, keys)
+    idx[idx == len(pref_keys)] = 0
+    weights = np.where(pref_keys[idx] == keys, pref_weights[idx], 0.0)
+    scores += np.bincount(rows, weights=weights, minlength=len(candidates))
+    return scores
+
+def score_naive(candidates, pref_keys, pref_weights):
+    """Reference implementation: one dict lookup per feature per candidate"""
+    weights = dict(zip(pref_keys.tolist(), pref_weights.tolist()))
+    scores = []
+    for c in candidates:
+        total = 0.0
+        for k in _keys(c.get('genres') or (), genre_key) + _keys(c.get('tags') or (), tag_key):
+            total += weights.get(k, 0.0)
+        scores.append(total)
+    return np.array(scores, dtype=np.float64)
+
+def rank(candidates, pref_keys, pref_weights, exclude=(), limit=20):
+    """The `limit` best candidates as (index, score), best first, skipping games in `exclude`"""
+    scores = score(candidates, pref_keys, pref_weights)
+    if exclude:
+        exclude = np.array(sorted(str(x) for x in exclude))
+        game_ids = np.array([str(c.get('game_id')) for c in candidates])
+        scores[np.isin(game_ids, exclude)] = -np.inf
+    order = np.argsort(-scores, kind='stable')[:limit]
+    return [(int(i), float(scores[i])) for i in order if scores[i] != -np.inf]
@@ -0,0 +1,160 @@
+"""
+Read replicas: `db` (models.py) uses RoutingSession, which sends the SELECTs of GET
+requests to a replica and everything else to the primary.
+
+Within a request, the first statement that writes (or locks, SELECT ... FOR UPDATE)
+sends the rest of the request to the primary too, so a request reads its own writes.
+Each request sticks to one replica, picked round-robin. A replica is connected to
+before its first use (and again after being left out), and one that can't be reached
+or loses its connection is left out for DB_REPLICA_RETRY seconds; with every replica
+left out, reads go to the primary. CLI commands and migrations always use the primary.
+
+Replicas lag behind the primary: a GET right after a write may see the data from
+before it, until the replica catches up. So nothing a request read from a replica is
+cached (`read_from_replica`): neither the user's collections (cache.py) nor the
+compressed body (compression.py), whose entries would be served as the current data.
+
+    DB_REPLICA_URLS=               comma separated replica URLs; none by default
+    DB_REPLICA_RETRY=30            seconds a failed replica is left out
+
+Locally, a copy of a SQLite database works as a replica:
+
+    $ cp example.db replica.db
+    $ DB_CONNECTION_STRING=sqlite:///example.db DB_REPLICA_URLS=sqlite:///replica.db flask run
+"""
+import itertools
+import os
+import threading
+import time
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event, orm
+from database import engine_options
+
+try:
+    from flask_sqlalchemy.session import Session as BaseSession
+except ImportError:  # Flask-SQLAlchemy < 3
+    from flask_sqlalchemy import SignallingSession as BaseSession
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+class ReplicaSet:
+    def __init__(self):
+        self.engines = []
+        self.retry = 30
+        self.reads = {}
+        self.failures = 0
+        self.fallbacks = 0
+        self._down_until = {}
+        self._checked = set()
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+    def configure(self, urls, retry=30):
+        for engine in self.engines:
+            engine.dispose()
+        self.engines = [create_engine(url, **engine_options(url)) for url in urls]
+        self.retry = retry
+        self.reads = dict((repr(engine.url), 0) for engine in self.engines)
+        self._down_until = {}
+        self._checked = set()
+        for engine in self.engines:
+            event.listen(engine, 'handle_error', self._on_error)
+
+    def _on_error(self, context):
+        # A lost connection or one that couldn't be opened, not a failing statement
+        if context.is_disconnect or context.connection is None:
+            self.leave_out(context.engine)
+
+    def leave_out(self, engine):
+        with self._lock:
+            self.failures += 1
+            self._down_until[engine] = time.monotonic() + self.retry
+            self._checked.discard(engine)
+
+    def available(self, engine):
+        if self._down_until.get(engine, 0) > time.monotonic():
+            return False
+        if engine not in self._checked:
+            try:
+                engine.connect().close()
+            except Exception:
+                # Already left out by _on_error
+                return False
+            self._checked.add(engine)
+        return True
+
+    # The next replica that isn't left out, or None
+    def pick(self):
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self._next) % len(self.engines)]
+            if self.available(engine):
+                self.reads[repr(engine.url)] += 1
+                return engine
+        self.fallbacks += 1
+        return None
+
+    def dispose(self, close=True):
+        for engine in self.engines:
+            try:
+                engine.dispose(close=close)
+            except TypeError:  # SQLAlchemy < 1.4.33
+                engine.dispose()
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "replicas": len(self.engines),
+            "reads": self.reads,
+            "down": [repr(engine.url) for engine, until in self._down_until.items() if until > now],
+            "failures": self.failures,
+            "primary_fallbacks": self.fallbacks,
+        }
+
+replicas = ReplicaSet()
+
+class RoutingSession(BaseSession):
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if kwargs.get('bind') is None:
+            engine = self.replica_for(clause)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause, **kwargs)
+
+    def replica_for(self, clause):
+        if not replicas.engines or not has_request_context() or request.method not in READ_METHODS:
+            return None
+        if g.get('_db_primary'):
+            return None
+        if self._flushing or not getattr(clause, 'is_select', False) or getattr(clause, '_for_update_arg', None) is not None:
+            # The rest of the request reads from where it wrote
+            g._db_primary = True
+            return None
+        if '_db_replica' not in g:
+            g._db_replica = replicas.pick()
+        return g._db_replica
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def __init__(self, *args, **kwargs):
+        if hasattr(SQLAlchemy, '_make_session_factory'):  # Flask-SQLAlchemy 3
+            kwargs.setdefault('session_options', {}).setdefault('class_', RoutingSession)
+        super().__init__(*args, **kwargs)
+
+    # Flask-SQLAlchemy < 3 has no option for the session class
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+# Whether the current request has read anything from a replica
+def read_from_replica():
+    return has_request_context() and g.get('_db_replica') is not None
+
+def forget_route():
+    g.pop('_db_primary', None)
+    g.pop('_db_replica', None)
+
+def setup_replicas(app):
+    urls = [url.strip() for url in os.environ.get('DB_REPLICA_URLS', '').split(',') if url.strip()]
+    replicas.configure(urls, int(os.environ.get('DB_REPLICA_RETRY', 30)))
+    # Each request picks again; g outlives a request when tests share an app context
+    app.before_request(forget_route)
+    app.extensions['replicas'] = replicas
@@ -0,0 +1,78 @@
+"""
+Synthetic data for benchmarks and local testing: users with their backlog, platforms
+and genre/tag likes and dislikes, written straight into the database with bulk inserts.
+
+    $ pipenv run seed --users 1000 --backlog 50 --platforms 3 --likes 20
+
+Every user gets `backlog` games out of a shared catalog of `games`, `platforms`
+platforms and `likes` ids in each of the four like/dislike collections (genres
+stop at what the 59 genres allow). The data only depends on the arguments and --seed.
+Seeded users are named seed<n>, with seed<n>@example.com and the password SEED_PASSWORD.
+"""
+import random
+import preferences
+from passwords import hasher
+from models import db, upsert, User, Game, Backlog, Platform, Preference, PreferenceSet
+
+SEED_PASSWORD = 'seed'
+STATUSES = ('playing', 'finished', 'wishlist', 'dropped')
+GENRE_IDS = range(1, 60)
+TAG_IDS = range(1, 5000)
+PLATFORM_IDS = range(1, 50)
+
+def seed_games(games, rng):
+    rows = [{"game_id": str(n), "game_name": 'Game %d %s' % (n, rng.choice(('Quest', 'Legends', 'Racer', 'Tactics', 'Online'))), "game_image": 'https://example.com/games/%d.jpg' % n} for n in range(1, games + 1)]
+    for start in range(0, len(rows), 1000):
+        upsert(Game, rows[start:start + 1000], update=False)
+
+def seed_users(start, count, backlog=20, platforms=3, likes=10, games=1000, rng=None, password=None):
+    """Writes users seed<start>..seed<start + count - 1> and their collections; returns their ids"""
+    rng = rng if rng is not None else random.Random(42)
+    password = password if password is not None else hasher.hash(SEED_PASSWORD)
+    names = ['seed%d' % n for n in range(start, start + count)]
+    db.session.execute(User.__table__.insert(), [{"email": '%s@example.com' % name, "username": name, "password": password, "version": 1} for name in names])
+    ids = dict(db.session.query(User.username, User.id).filter(User.username.in_(names)))
+
+    backlog_rows, platform_rows, preference_rows, set_rows = [], [], [], []
+    for name in names:
+        user_id = ids[name]
+        for game_id in rng.sample(range(1, games + 1), min(backlog, games)):
+            backlog_rows.append({"user_id": user_id, "game_id": str(game_id), "game_status": rng.choice(STATUSES), "version": 1})
+        for platform_id in rng.sample(PLATFORM_IDS, min(platforms, len(PLATFORM_IDS))):
+            platform_rows.append({"user_id": user_id, "platform_id": str(platform_id), "platform_name": 'Platform %d' % platform_id, "version": 1})
+        taste = {"user_id": user_id}
+        for pool, liked, disliked, label in ((GENRE_IDS, 'genres_liked', 'genres_disliked', 'Genre'), (TAG_IDS, 'tags_liked', 'tags_disliked', 'Tag')):
+            picked = rng.sample(pool, min(2 * likes, len(pool)))
+            for collection, values in ((liked, picked[:len(picked) // 2]), (disliked, picked[len(picked) // 2:])):
+                model, column = PreferenceSet.sources[collection]
+                for value in values:
+                    preference_rows.append(model.insert_row({"user_id": user_id, column: str(value), model.name_field: '%s %d' % (label, value), "version": 1}))
+                taste[collection] = preferences.pack(values)
+        set_rows.append(taste)
+
+    for table, rows in ((Backlog.__table__, backlog_rows), (Platform.__table__, platform_rows), (Preference.__table__, preference_rows), (PreferenceSet.__table__, set_rows)):
+        if rows:
+            db.session.execute(table.insert(), rows)
+    return [ids[name] for name in names]
+
+# The first free n for seed<n>: after the highest one taken, as a username or an email,
+# so seeding twice adds more and real users named seed<something> never collide
+def next_seed_number():
+    taken = db.session.query(User.username).filter(User.username.like('seed%')).union_all(
+        db.session.query(User.email).filter(User.email.like('seed%@example.com')))
+    numbers = [int(name[4:].split('@')[0]) for (name,) in taken if name[4:].split('@')[0].isdigit()]
+    return max(numbers) + 1 if numbers else 0
+
+def seed(users=100, backlog=20, platforms=3, likes=10, games=1000, random_seed=42, batch_size=500):
+    """Seeds the catalog and `users` new users, `batch_size` users per transaction; returns the user ids"""
+    rng = random.Random(random_seed)
+    seed_games(games, rng)
+    db.session.commit()
+    start = next_seed_number()
+    # Hashed once: every seeded user shares the same password hash
+    password = hasher.hash(SEED_PASSWORD)
+    user_ids = []
+    for offset in range(0, users, batch_size):
+        user_ids += seed_users(start + offset, min(batch_size, users - offset), backlog, platforms, likes, games, rng, password)
+        db.session.commit()
+    return user_ids
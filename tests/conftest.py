@@ -0,0 +1,27 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+# Must be set before main is imported: the tests never touch a real database
+os.environ['DB_CONNECTION_STRING'] = 'sqlite://'
+
+@pytest.fixture
+def app():
+    from main import app
+    from models import db
+    from cache import setup_cache
+    from catalog import setup_catalog
+
+    with app.app_context():
+        db.create_all()
+        # Empty caches: what a test counts must not depend on the one before
+        setup_cache(app)
+        setup_catalog(app)
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
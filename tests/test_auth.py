@@ -0,0 +1,23 @@
+from datetime import timedelta
+from flask_jwt_extended import create_access_token
+
+def protected(client, token):
+    return client.get('/protected', headers={'Authorization': 'Bearer %s' % token})
+
+def test_token_close_to_expiry_is_refreshed(app, client):
+    token = create_access_token(identity=1, expires_delta=timedelta(minutes=30))
+    response = protected(client, token)
+    assert response.status_code == 200
+
+    refreshed = response.headers.get('X-Access-Token')
+    assert refreshed and refreshed != token
+    # The new token works and is far enough from expiry not to be replaced again
+    response = protected(client, refreshed)
+    assert response.get_json() == {"user_id": 1}
+    assert 'X-Access-Token' not in response.headers
+
+def test_fresh_token_and_anonymous_requests_are_not_refreshed(app, client):
+    response = protected(client, create_access_token(identity=1))
+    assert response.status_code == 200
+    assert 'X-Access-Token' not in response.headers
+    assert 'X-Access-Token' not in client.get('/').headers
@@ -0,0 +1,46 @@
+from cache import user_cache
+from models import db, User, Platform
+from test_users import COLLECTIONS, add_users
+
+def stats(client):
+    return client.get('/cache/stats').get_json()
+
+def platform_ids(client):
+    return [item["platform_id"] for item in client.get('/user/1/platforms').get_json()]
+
+def test_repeat_reads_hit_the_cache(app, client):
+    add_users(client, [1])
+    before = stats(client)
+    assert platform_ids(client) == ["4"]
+    assert platform_ids(client) == ["4"]
+    after = stats(client)
+    assert (after["misses"] - before["misses"], after["hits"] - before["hits"]) == (1, 1)
+
+def test_writes_invalidate_the_collection(app, client):
+    add_users(client, [1])
+    assert platform_ids(client) == ["4"]
+    invalidations = stats(client)["invalidations"]
+
+    assert client.post('/user/1/platforms', json=dict(COLLECTIONS['platforms'], platform_id="7")).status_code == 200
+    assert platform_ids(client) == ["4", "7"]
+    platform = client.get('/user/1/platforms').get_json()[0]["id"]
+    assert client.delete('/user/1/platforms/%d' % platform).status_code == 200
+    assert platform_ids(client) == ["7"]
+    assert stats(client)["invalidations"] == invalidations + 2
+
+def test_entries_from_an_older_version_are_not_served(app, client):
+    add_users(client, [1])
+    assert platform_ids(client) == ["4"]
+    # A write from another worker: its invalidation never reached this cache
+    db.session.add(Platform(user_id=1, platform_id="9", platform_name="Switch", version=User.bump_version(1)))
+    db.session.commit()
+    assert platform_ids(client) == ["4", "9"]
+
+def test_profile_reads_the_same_entries(app, client):
+    add_users(client, [1])
+    profile = client.get('/user/1/profile').get_json()
+    assert [item["platform_id"] for item in profile["user_platforms"]] == ["4"]
+    # Loaded by the profile, served from the cache by the collection's own GET
+    hits = user_cache.hits
+    assert platform_ids(client) == ["4"]
+    assert user_cache.hits == hits + 1
@@ -0,0 +1,48 @@
+from test_users import add_users
+
+GAME = {"game_id": "620", "game_name": "Portal 2", "game_image": "https://example.com/620.jpg", "game_status": "playing"}
+
+def add_game(client, user_id, **fields):
+    response = client.post('/user/%d/backlog' % user_id, json=dict(GAME, **fields))
+    assert response.status_code == 200
+    return response.get_json()
+
+def names(client, user_id):
+    return [(item["game_name"], item["game_image"]) for item in client.get('/user/%d/backlog' % user_id).get_json() if item["game_id"] == GAME["game_id"]]
+
+def test_missing_name_is_filled_by_a_later_writer(app, client):
+    add_users(client, [1, 2])
+    add_game(client, 1, game_name=None, game_image=None)
+    assert names(client, 1) == [(None, None)]
+    etag = client.get('/user/1/backlog').headers['ETag']
+
+    add_game(client, 2)
+    # User 1's cached, ETagged backlog sees the name user 2 sent
+    response = client.get('/user/1/backlog', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert names(client, 1) == [("Portal 2", "https://example.com/620.jpg")]
+
+def test_complete_entry_keeps_the_first_copy(app, client):
+    add_users(client, [1, 2])
+    add_game(client, 1)
+    add_game(client, 2, game_name="Portal Two", game_image=None)
+    assert names(client, 2) == [("Portal 2", "https://example.com/620.jpg")]
+
+def test_put_fills_a_missing_name_of_its_game(app, client):
+    add_users(client, [1])
+    item = add_game(client, 1, game_name=None)
+    response = client.put('/user/1/updatebl/%d' % item["id"], json={"game_id": GAME["game_id"], "game_name": "Portal 2"})
+    assert response.status_code == 200
+    assert response.get_json()["game_name"] == "Portal 2"
+
+def test_admin_edit_reaches_cached_backlogs(app, client):
+    add_users(client, [1])
+    add_game(client, 1)
+    cursor = client.get('/user/1/changes').get_json()["cursor"]
+    assert names(client, 1) == [("Portal 2", "https://example.com/620.jpg")]
+
+    response = client.post('/admin/game/edit/?id=%s' % GAME["game_id"], data={"game_name": "Portal 2: Deluxe", "game_image": GAME["game_image"]})
+    assert response.status_code == 302
+    assert names(client, 1) == [("Portal 2: Deluxe", "https://example.com/620.jpg")]
+    upserted = client.get('/user/1/changes?since=%d' % cursor).get_json()["changes"]["user_games"]["upserted"]
+    assert [item["game_name"] for item in upserted] == ["Portal 2: Deluxe"]
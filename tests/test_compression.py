@@ -0,0 +1,51 @@
+import gzip
+import pytest
+from cache import LRUCache
+from compression import compressor
+from test_users import add_users
+
+GZIP = {'Accept-Encoding': 'gzip'}
+
+@pytest.fixture
+def backlog(app, client):
+    # The compressed bodies are cached by ETag, which restarts with every test database
+    compressor.cache = LRUCache(maxsize=256, ttl=3600)
+    add_users(client, [1])
+    games = [{"game_id": str(n), "game_name": "Game %d" % n, "game_image": "https://example.com/%d.jpg" % n, "game_status": "playing"} for n in range(40)]
+    assert client.post('/user/1/backlog/bulk', json=games).status_code == 200
+    return '/user/1/backlog'
+
+def test_large_responses_are_gzipped(backlog, client):
+    plain = client.get(backlog)
+    response = client.get(backlog, headers=GZIP)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()) == plain.get_data()
+    # Its own strong ETag, per content coding
+    assert response.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+
+def test_repeat_reads_reuse_the_compressed_body(backlog, client):
+    first = client.get(backlog, headers=GZIP).get_data()
+    hits = compressor.cache_hits
+    assert client.get(backlog, headers=GZIP).get_data() == first
+    assert compressor.cache_hits == hits + 1
+
+def test_compressed_etag_gets_a_304(backlog, client):
+    etag = client.get(backlog, headers=GZIP).headers['ETag']
+    response = client.get(backlog, headers=dict(GZIP, **{'If-None-Match': etag}))
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+def test_small_streamed_and_unasked_responses_are_sent_as_they_are(backlog, client):
+    assert 'Content-Encoding' not in client.get('/user/1/platforms', headers=GZIP).headers
+    streamed = client.get(backlog + '?stream=json', headers=GZIP)
+    assert 'Content-Encoding' not in streamed.headers
+    streamed.get_data()
+    assert 'Content-Encoding' not in client.get(backlog).headers
+
+def test_brotli_is_preferred_when_installed(backlog, client):
+    brotli = pytest.importorskip('brotli')
+    plain = client.get(backlog)
+    response = client.get(backlog, headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.get_data()) == plain.get_data()
@@ -0,0 +1,31 @@
+from test_users import COLLECTIONS, add_users
+
+def test_unchanged_data_is_not_sent_again(app, client):
+    add_users(client, [1])
+    first = client.get('/user/1/backlog')
+    etag = first.headers['ETag']
+
+    response = client.get('/user/1/backlog', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    assert response.headers['ETag'] == etag
+
+def test_any_write_to_the_user_changes_the_etag(app, client):
+    add_users(client, [1])
+    etag = client.get('/user/1/backlog').headers['ETag']
+    # A write to another collection of the same user counts too
+    assert client.post('/user/1/platforms', json=dict(COLLECTIONS['platforms'], platform_id="7")).status_code == 200
+
+    response = client.get('/user/1/backlog', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_etags_differ_per_request_and_per_user(app, client):
+    add_users(client, [1, 2])
+    tags = set(client.get(path).headers['ETag'] for path in ('/user/1/backlog', '/user/1/backlog?limit=1', '/user/1/platforms', '/user/2/backlog'))
+    assert len(tags) == 4
+
+def test_unknown_user_has_no_etag(app, client):
+    response = client.get('/user/99')
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
@@ -0,0 +1,21 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from models import db
+
+def test_failed_statements_leave_nothing_on_the_connection(app):
+    for _ in range(3):
+        with pytest.raises(OperationalError):
+            db.session.execute(text('SELECT * FROM no_such_table'))
+        db.session.rollback()
+    connection = db.session.connection()
+    assert [key for key in connection.info if 'metrics' in key] == []
+
+def test_requests_are_counted_with_their_sql(app, client):
+    response = client.get('/users')
+    assert response.status_code == 200
+    # Recorded once the response is closed, after the body went out
+    response.close()
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'hexbreak_requests_total{method="GET",endpoint="/users",status="200"}' in body
+    assert 'hexbreak_request_sql_statements_count{method="GET",endpoint="/users"}' in body
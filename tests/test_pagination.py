@@ -0,0 +1,75 @@
+import json
+import pytest
+from pagination import encode_cursor
+from test_users import add_users
+
+NDJSON = 'application/x-ndjson'
+
+def ids(response):
+    return [item["id"] for item in response.get_json()]
+
+def test_pages_follow_the_next_cursor(app, client):
+    add_users(client, range(1, 6))
+    seen = []
+    path = '/users?limit=2&fields=id'
+    while True:
+        response = client.get(path)
+        assert response.status_code == 200
+        seen += ids(response)
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            break
+        path = '/users?limit=2&fields=id&after=%s' % cursor
+    assert seen == [1, 2, 3, 4, 5]
+
+def test_sorted_pages_carry_the_sort_value(app, client):
+    add_users(client, [1])
+    for game_id, name in (("1", "b"), ("2", "a"), ("3", "c")):
+        assert client.post('/user/1/backlog', json={"game_id": game_id, "game_name": name, "game_image": "", "game_status": "playing"}).status_code == 200
+    first = client.get('/user/1/backlog?sort=-name&limit=2')
+    rest = client.get('/user/1/backlog?sort=-name&limit=2&after=%s' % first.headers['X-Next-Cursor'])
+    names = [item["game_name"] for item in first.get_json() + rest.get_json()]
+    assert names == ["Grand Theft Auto V", "c", "b", "a"]
+    assert 'X-Next-Cursor' not in rest.headers
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    encode_cursor([]),
+    encode_cursor(["1"]),
+    encode_cursor([True]),
+    encode_cursor([2**63]),
+    encode_cursor([1, 2]),
+])
+def test_invalid_cursors_are_rejected(app, client, cursor):
+    response = client.get('/users?limit=2&after=%s' % cursor)
+    assert response.status_code == 400
+    assert response.get_json()["message"] == 'Invalid cursor.'
+
+@pytest.mark.parametrize('limit', ['0', '1001', 'ten'])
+def test_invalid_limits_are_rejected(app, client, limit):
+    assert client.get('/users?limit=%s' % limit).status_code == 400
+
+def test_streams_match_the_plain_list(app, client):
+    add_users(client, range(1, 4))
+    plain = client.get('/users').get_json()
+
+    response = client.get('/users?stream=json')
+    assert response.is_streamed and response.mimetype == 'application/json'
+    assert json.loads(response.get_data(as_text=True)) == plain
+
+    response = client.get('/users?stream=ndjson')
+    assert response.mimetype == NDJSON
+    assert [json.loads(line) for line in response.get_data(as_text=True).splitlines()] == plain
+
+    assert client.get('/users?stream=xml').status_code == 400
+
+def test_accept_ndjson_alone_streams_a_collection(app, client):
+    add_users(client, [1])
+    # Warm the cache the plain GET reads from
+    assert client.get('/user/1/backlog').mimetype == 'application/json'
+
+    response = client.get('/user/1/backlog', headers={'Accept': NDJSON})
+    assert response.status_code == 200
+    assert response.mimetype == NDJSON
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line)["game_id"] for line in lines] == ["3498"]
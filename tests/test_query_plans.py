@@ -0,0 +1,91 @@
+import re
+import pytest
+from sqlalchemy import event
+import main
+from models import db, User, Platform, Game, Backlog, GenreLike, GenreDislike, TagLike, TagDislike
+
+USERS = 5
+ROWS_PER_USER = 10
+# "SCAN backlog", "SCAN TABLE backlog" or "SCAN backlog USING COVERING INDEX ...", but
+# not "SCAN game_fts VIRTUAL TABLE INDEX 0:M0", which is a full-text index lookup
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?(?P<table>\w+)\b(?! VIRTUAL TABLE INDEX \d+:\S)')
+
+# Every GET route whose only arguments identify a single user, with each of the
+# query parameters that change the SQL it runs
+def per_user_urls():
+    values = {'user_id': 2, 'username': 'user2'}
+    for rule in main.app.url_map.iter_rules():
+        if 'GET' not in rule.methods or not rule.arguments:
+            continue
+        if not rule.arguments.issubset(values):
+            continue
+        url = rule.build({name: values[name] for name in rule.arguments}, append_unknown=False)[1]
+        yield url
+        yield url + '?limit=3'
+        yield url + '?since=1'
+        yield url + '?status=playing&q=Game&sort=-name&limit=3'
+        yield url + '?prefix=Gam&sort=status'
+
+@pytest.fixture
+def seeded(app):
+    for i in range(ROWS_PER_USER):
+        db.session.add(Game(game_id=str(i), game_name='Game %d' % i, game_image=''))
+    for n in range(1, USERS + 1):
+        user = User(email='user%d@example.com' % n, username='user%d' % n, password='password')
+        db.session.add(user)
+        db.session.flush()
+        for i in range(ROWS_PER_USER):
+            db.session.add(Backlog(user_id=user.id, game_id=str(i), game_status='playing'))
+            db.session.add(Platform(user_id=user.id, platform_name='Platform %d' % i, platform_id=str(i)))
+            db.session.add(GenreLike(user_id=user.id, genre_name='Genre %d' % i, genre_id=str(i)))
+            db.session.add(GenreDislike(user_id=user.id, genre_name='Genre %d' % i, genre_id=str(i)))
+            db.session.add(TagLike(user_id=user.id, tag_name='Tag %d' % i, tag_id=str(i)))
+            db.session.add(TagDislike(user_id=user.id, tag_name='Tag %d' % i, tag_id=str(i)))
+    db.session.commit()
+    return app
+
+# The statements a GET of `url` runs, with their parameters
+def capture(client, url):
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url)
+        # Streamed bodies run their query as they are read
+        response.get_data()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    assert response.status_code == 200, url
+    return executed
+
+def plan(statement, parameters):
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+@pytest.mark.parametrize('url', list(per_user_urls()))
+def test_per_user_reads_use_an_index(seeded, client, url):
+    statements = capture(client, url)
+    assert statements
+    for statement, parameters in statements:
+        details = plan(statement, parameters)
+        scans = [detail for detail in details if FULL_SCAN.match(detail)]
+        assert not scans, 'full scan in GET %s\n  %s\n  plan: %s' % (url, ' '.join(statement.split()), '; '.join(details))
+
+# A single preference collection is one (user_id, kind, polarity) range of the
+# profile index, not a scan of the user's whole profile
+@pytest.mark.parametrize('url', ['/user/2/genrelikes', '/user/2/genredislikes?limit=3', '/user/2/taglike?stream=json', '/user/2/tagdislike'])
+def test_preference_collection_reads_seek_on_kind_and_polarity(seeded, client, url):
+    reads = []
+    for statement, parameters in capture(client, url):
+        if re.search(r'\bFROM preference\b', statement):
+            reads.extend(detail for detail in plan(statement, parameters) if re.match(r'(SEARCH|SCAN) (TABLE )?preference\b', detail))
+    assert reads
+    assert all(detail.endswith('ix_preference_profile (user_id=? AND kind=? AND polarity=?)') for detail in reads), reads
@@ -0,0 +1,24 @@
+import pytest
+from test_users import add_users
+
+def recommend(client, body):
+    return client.post('/user/1/recommendations', json=body)
+
+@pytest.mark.parametrize('game_id', [-2**63, 2**62, -2**62])
+def test_out_of_range_ids_are_rejected(app, client, game_id):
+    add_users(client, [1])
+    response = recommend(client, {"games": [{"game_id": 1, "genres": [game_id], "tags": []}]})
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('limit', [True, False, 0, "5"])
+def test_limit_must_be_a_positive_integer(app, client, limit):
+    add_users(client, [1])
+    response = recommend(client, {"games": [], "limit": limit})
+    assert response.status_code == 400
+
+def test_liked_genres_rank_first(app, client):
+    add_users(client, [1])
+    games = [{"game_id": 1, "genres": [51]}, {"game_id": 2, "genres": [4], "tags": [31]}, {"game_id": 3498, "genres": [4]}]
+    response = recommend(client, {"games": games, "limit": 2})
+    # 3498 is already in the backlog
+    assert [game["game_id"] for game in response.get_json()] == [2, 1]
@@ -0,0 +1,15 @@
+from seed import seed
+from models import db, User
+
+def usernames():
+    return sorted(name for (name,) in db.session.query(User.username))
+
+def test_seeding_skips_names_real_users_have(app, client):
+    for name in ('seed2', 'seedling'):
+        assert client.post('/register', json={"email": "%s@example.org" % name, "username": name, "password": "secret"}).status_code == 200
+
+    seed(users=2, backlog=2, platforms=1, likes=1, games=5)
+    assert usernames() == ['seed2', 'seed3', 'seed4', 'seedling']
+    # Seeding again adds more after them
+    seed(users=1, backlog=2, platforms=1, likes=1, games=5)
+    assert usernames() == ['seed2', 'seed3', 'seed4', 'seed5', 'seedling']
@@ -0,0 +1,40 @@
+import pytest
+from test_users import COLLECTIONS, add_users
+
+# The idempotent POSTs: collection -> (path, the field that makes an item a duplicate)
+UPSERTS = {
+    'user_platforms': ('platforms', 'platform_id'),
+    'genres_liked': ('genrelikes', 'genre_id'),
+    'genres_disliked': ('genredislikes', 'genre_id'),
+    'tags_liked': ('taglike', 'tag_id'),
+    'tags_disliked': ('tagdislike', 'tag_id'),
+}
+
+@pytest.mark.parametrize('collection', sorted(UPSERTS))
+def test_repeated_post_keeps_one_row(app, client, collection):
+    path, key = UPSERTS[collection]
+    add_users(client, [1])
+    first = client.get('/user/1/%s' % path).get_json()[0]
+
+    # Sent again, with a new name: same row, same id, name updated
+    item = dict(COLLECTIONS[path])
+    name = [field for field in item if field != key][0]
+    item[name] = 'Renamed'
+    response = client.post('/user/1/%s' % path, json=item)
+    assert response.status_code == 200
+    assert response.get_json()["id"] == first["id"]
+
+    rows = client.get('/user/1/%s' % path).get_json()
+    assert [(row["id"], row[name]) for row in rows] == [(first["id"], 'Renamed')]
+
+def test_repeated_bulk_post_keeps_one_row(app, client):
+    add_users(client, [1])
+    item = COLLECTIONS['taglike']
+    assert client.post('/user/1/taglike/bulk', json=[item, item]).status_code == 200
+    assert client.post('/user/1/taglike/bulk', json=[item]).status_code == 200
+    assert [row["tag_id"] for row in client.get('/user/1/taglike').get_json()] == [item["tag_id"]]
+
+def test_same_id_for_another_user_is_its_own_row(app, client):
+    add_users(client, [1, 2])
+    ids = [client.get('/user/%d/platforms' % user_id).get_json()[0]["id"] for user_id in (1, 2)]
+    assert ids[0] != ids[1]
@@ -0,0 +1,126 @@
+import pytest
+from sqlalchemy import event
+from catalog import setup_catalog
+from models import db, User
+
+COLLECTIONS = {
+    'backlog': {"game_id": "3498", "game_name": "Grand Theft Auto V", "game_image": "https://example.com/3498.jpg", "game_status": "playing"},
+    'platforms': {"platform_id": "4", "platform_name": "PC"},
+    'genrelikes': {"genre_id": "4", "genre_name": "Action"},
+    'genredislikes': {"genre_id": "51", "genre_name": "Indie"},
+    'taglike': {"tag_id": "31", "tag_name": "Singleplayer"},
+    'tagdislike': {"tag_id": "7", "tag_name": "Multiplayer"},
+}
+
+def add_users(client, ids):
+    for user_id in ids:
+        response = client.post('/register', json={"email": "user%d@example.com" % user_id, "username": "user%d" % user_id, "password": "secret"})
+        assert response.status_code == 200
+        assert response.get_json()["id"] == user_id
+        for path, item in COLLECTIONS.items():
+            assert client.post('/user/%d/%s' % (user_id, path), json=item).status_code == 200
+
+# The statements a GET of `path` runs, with the game catalog as cold as on the first request
+def statements(app, client, path):
+    setup_catalog(app)
+    executed = []
+
+    def count(conn, cursor, statement, *args):
+        executed.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+    assert response.status_code == 200
+    return executed
+
+@pytest.mark.parametrize('path', ['/users', '/users?limit=20', '/users?include=user_games', '/users?fields=id,username'])
+def test_users_statements_do_not_grow_with_users(app, client, path):
+    add_users(client, [1])
+    one = statements(app, client, path)
+    add_users(client, range(2, 11))
+    many = statements(app, client, path)
+
+    assert len(client.get(path).get_json()) == 10
+    assert len(many) == len(one)
+
+@pytest.mark.parametrize('path', sorted(COLLECTIONS))
+def test_writes_for_a_missing_user_are_404(app, client, path):
+    add_users(client, [1])
+    response = client.post('/user/99/%s' % path, json=COLLECTIONS[path])
+    assert response.status_code == 404
+    assert response.get_json()["message"] == 'Username does not exist.'
+    # Nothing of the failed write is left in the session for the next request
+    assert client.post('/user/1/%s' % path, json=COLLECTIONS[path]).status_code == 200
+
+@pytest.mark.parametrize('since', ['abc', str(2**63), str(-2**63 - 1), '99999999999999999999'])
+def test_changes_rejects_bad_since(app, client, since):
+    add_users(client, [1])
+    assert client.get('/user/1/changes?since=%s' % since).status_code == 400
+    assert client.get('/user/1/changes?since=%d' % (2**63 - 1)).status_code == 200
+
+def test_bulk_post_echoes_only_the_sent_fields(app, client):
+    add_users(client, [1])
+    item = COLLECTIONS['taglike']
+    response = client.post('/user/1/taglike/bulk', json=[item, {"tag_id": "8"}])
+    assert response.get_json() == [{"status": 201, "item": item}, {"status": 400, "error": "Missing tag_name"}]
+
+# A delete is the owned DELETE, the version bump and its tombstone: on SQLite (no
+# RETURNING) a SELECT plus the DELETE, then the UPDATE and an INSERT ... SELECT
+def test_delete_leaves_a_tombstone_without_reading_the_version_back(app, client):
+    add_users(client, [1])
+    item_id = client.get('/user/1/backlog').get_json()[0]["id"]
+    cursor = client.get('/user/1/changes').get_json()["cursor"]
+
+    executed = []
+
+    def count(conn, cursor, statement, *args):
+        executed.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        assert client.delete('/user/1/removebl/%d' % item_id).status_code == 200
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+    assert len(executed) == 4
+
+    changes = client.get('/user/1/changes?since=%d' % cursor).get_json()
+    assert changes["cursor"] == cursor + 1
+    assert changes["changes"]["user_games"] == {"upserted": [], "deleted": [item_id]}
+
+def test_bulk_put_rejects_a_null_game_id(app, client):
+    add_users(client, [1])
+    item_id = client.get('/user/1/backlog').get_json()[0]["id"]
+    response = client.put('/user/1/backlog/bulk', json={"ids": [item_id], "game_id": None})
+    assert response.status_code == 400
+    assert client.get('/user/1/backlog').get_json()[0]["game_id"] == "3498"
+
+# Writes through the admin change what the API serves, like the API's own writes
+def test_admin_writes_bump_the_user_version(app, client):
+    add_users(client, [1])
+    user = client.get('/user/1')
+    etag = user.headers['ETag']
+    # What the edit form posts: the collections are multi-selects of their row ids
+    form = dict((name, [str(item["id"]) for item in user.get_json()[name]]) for name in User.collections)
+    form.update(email="one@example.com", username="one", password="x")
+    response = client.post('/admin/user/edit/?id=1', data=form)
+    assert response.status_code == 302
+    response = client.get('/user/1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()["username"] == "one"
+
+    item = client.get('/user/1/backlog').get_json()[0]
+    response = client.post('/admin/backlog/edit/?id=%d' % item["id"], data={"user": "1", "game_status": "finished"})
+    assert response.status_code == 302
+    assert client.get('/user/1/backlog').get_json()[0]["game_status"] == "finished"
+
+    cursor = client.get('/user/1/changes').get_json()["cursor"]
+    liked = client.get('/user/1/genrelikes').get_json()[0]["id"]
+    assert client.post('/admin/genrelike/delete/', data={"id": liked}).status_code == 302
+    assert client.get('/user/1/genrelikes').get_json() == []
+    assert client.get('/user/1/changes?since=%d' % cursor).get_json()["changes"]["genres_liked"]["deleted"] == [liked]
+    # The liked genre no longer counts for recommendations
+    games = [{"game_id": 1, "genres": [4]}]
+    assert client.post('/user/1/recommendations', json={"games": games}).get_json() == [{"game_id": 1, "score": 0.0}]